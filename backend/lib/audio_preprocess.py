@@ -0,0 +1,210 @@
+"""
+Audio preprocessing for the voice privacy demo.
+Decodes browser recordings to 16 kHz mono, trims leading/trailing silence and
+re-encodes to a compact format before the clip is sent to Whisper.
+
+Decoding and encoding go through the ffmpeg binary; the silence detector needs
+numpy. If either is missing the clip is passed through untouched.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import wave
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FFMPEG = shutil.which("ffmpeg")
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+# Frames quieter than this (dB relative to full scale) count as silence
+SILENCE_DBFS = float(os.getenv("VOICE_SILENCE_DBFS", "-45"))
+# For trimming only, frames within this many dB of the clip's noise floor are
+# also dropped...
+NOISE_FLOOR_MARGIN_DB = 12.0
+# ...but the trim threshold never rises above this far below the loudest frame,
+# so a clip that is speech from start to finish is kept whole
+TRIM_BELOW_PEAK_DB = 20.0
+# Keep a little audio around the speech so first/last syllables aren't clipped
+PAD_SECONDS = 0.2
+# Clips with less detected speech than this are treated as silent
+MIN_SPEECH_SECONDS = float(os.getenv("VOICE_MIN_SPEECH_SECONDS", "0.3"))
+OPUS_BITRATE = "24k"
+# Used to estimate a clip's length when it can't be decoded: roughly what
+# browsers record Opus/WebM at (32 kbps)
+ESTIMATE_BYTES_PER_SECOND = float(os.getenv("VOICE_ESTIMATE_BYTES_PER_SECOND", "4000"))
+
+
+@dataclass
+class PreparedAudio:
+    data: bytes
+    filename: str
+    has_speech: bool = True
+    samples: Optional["np.ndarray"] = None  # 16 kHz mono float32, trimmed
+    duration_seconds: Optional[float] = None
+
+
+def preprocessing_enabled() -> bool:
+    """Preprocessing needs ffmpeg + numpy and can be switched off with VOICE_PREPROCESS=0"""
+    if os.getenv("VOICE_PREPROCESS", "1") == "0":
+        return False
+    return FFMPEG is not None and np is not None
+
+
+def _run_ffmpeg(args: list, data: bytes) -> bytes:
+    proc = subprocess.run(
+        [FFMPEG, "-hide_banner", "-loglevel", "error", *args],
+        input=data,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    return proc.stdout
+
+
+def decode_pcm(raw: bytes) -> "np.ndarray":
+    """Decode any container ffmpeg understands to 16 kHz mono float32 in [-1, 1]"""
+    pcm = _run_ffmpeg(
+        ["-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        raw,
+    )
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def frame_levels_db(samples: "np.ndarray") -> "np.ndarray":
+    """RMS level of each FRAME_SECONDS frame in dBFS (trailing partial frame dropped)"""
+    frame_len = int(SAMPLE_RATE * FRAME_SECONDS)
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = samples[: n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-10))
+
+
+def voiced_frames(levels: "np.ndarray") -> "np.ndarray":
+    """Boolean mask of frames loud enough to be speech (absolute floor only)"""
+    return levels > SILENCE_DBFS
+
+
+def trim_frames(levels: "np.ndarray") -> "np.ndarray":
+    """
+    Boolean mask of frames worth keeping when trimming the edges. Also drops
+    background noise that is above SILENCE_DBFS, relative to the clip's own
+    noise floor, capped at TRIM_BELOW_PEAK_DB under its loudest frame.
+    """
+    noise_floor = np.percentile(levels, 10)
+    relative = min(noise_floor + NOISE_FLOOR_MARGIN_DB, levels.max() - TRIM_BELOW_PEAK_DB)
+    return levels > max(SILENCE_DBFS, relative)
+
+
+def speech_bounds(samples: "np.ndarray") -> Optional[Tuple[int, int]]:
+    """
+    Sample range [start, end) covering the speech in the clip, padded by
+    PAD_SECONDS on each side. None if the clip is (almost) entirely silent.
+    """
+    levels = frame_levels_db(samples)
+    frame_len = int(SAMPLE_RATE * FRAME_SECONDS)
+    # Whether there is speech at all is decided on the absolute floor alone
+    if voiced_frames(levels).sum() * FRAME_SECONDS < MIN_SPEECH_SECONDS:
+        return None
+
+    active = np.flatnonzero(trim_frames(levels))
+    pad = int(SAMPLE_RATE * PAD_SECONDS)
+    start = max(0, int(active[0]) * frame_len - pad)
+    end = min(len(samples), (int(active[-1]) + 1) * frame_len + pad)
+    return start, end
+
+
+def split_at_silence(samples: "np.ndarray", target_seconds: float, max_seconds: float) -> List[Tuple[int, int]]:
+    """
+    Split samples into consecutive [start, end) ranges of roughly target_seconds,
+    never longer than max_seconds. Each cut is placed on the quietest frame
+    between the target and max length, so words aren't chopped in half.
+    """
+    frame_len = int(SAMPLE_RATE * FRAME_SECONDS)
+    levels = frame_levels_db(samples)
+    target = max(1, int(target_seconds / FRAME_SECONDS))
+    longest = max(target, int(max_seconds / FRAME_SECONDS))
+
+    segments = []
+    start = 0
+    n_frames = levels.size
+    while n_frames - start > longest:
+        window = levels[start + target:start + longest]
+        cut = start + target + int(np.argmin(window))
+        segments.append((start * frame_len, cut * frame_len))
+        start = cut
+    segments.append((start * frame_len, len(samples)))
+    return segments
+
+
+def encode_compact(samples: "np.ndarray") -> Tuple[bytes, str]:
+    """Encode mono 16 kHz samples as Ogg/Opus, falling back to 16-bit WAV"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+    if FFMPEG is not None:
+        try:
+            data = _run_ffmpeg(
+                ["-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0",
+                 "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-f", "ogg", "pipe:1"],
+                pcm,
+            )
+            if data:
+                return data, "audio.ogg"
+        except (OSError, subprocess.CalledProcessError):
+            pass  # ffmpeg built without libopus; WAV is still far smaller than the upload
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buf.getvalue(), "audio.wav"
+
+
+def estimate_duration_seconds(raw: bytes) -> float:
+    """Clip length without ffmpeg: exact for WAV, from the upload size otherwise"""
+    try:
+        with wave.open(io.BytesIO(raw), "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return len(raw) / ESTIMATE_BYTES_PER_SECOND
+
+
+def preprocess_audio(raw: bytes, filename: str) -> PreparedAudio:
+    """
+    Decode, trim silence and re-encode a recording.
+
+    Blocking (runs ffmpeg); call it from a worker thread in async code.
+    Returns the original bytes unchanged if preprocessing is unavailable or
+    the clip can't be decoded, so Whisper still gets a chance at it.
+    """
+    if not preprocessing_enabled():
+        return PreparedAudio(data=raw, filename=filename)
+
+    try:
+        samples = decode_pcm(raw)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Audio decode failed, sending original clip: {e}")
+        return PreparedAudio(data=raw, filename=filename)
+
+    bounds = speech_bounds(samples)
+    if bounds is None:
+        return PreparedAudio(data=b"", filename=filename, has_speech=False, duration_seconds=0.0)
+
+    trimmed = samples[bounds[0]:bounds[1]]
+    data, name = encode_compact(trimmed)
+    return PreparedAudio(
+        data=data,
+        filename=name,
+        samples=trimmed,
+        duration_seconds=len(trimmed) / SAMPLE_RATE,
+    )
@@ -0,0 +1,133 @@
+"""
+Bounded in-process job queue with a fixed worker pool.
+Submitting returns immediately with a job id; workers publish partial results
+onto the job as they become available and clients poll or long-poll for them.
+"""
+
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the backlog is at its limit"""
+
+
+class Job:
+    def __init__(self, payload: Any):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = "queued"
+        self.result: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.version = 0
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def publish(self, status: Optional[str] = None, **fields) -> None:
+        """Update status and/or result fields and wake anyone long-polling"""
+        if status is not None:
+            self.status = status
+        self.result.update(fields)
+        if self.done and self.finished is None:
+            self.finished = time.time()
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, since_version: int, timeout: float) -> None:
+        """Return once version > since_version, the job is finished, or timeout passes"""
+        if self.version > since_version or self.done or timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class JobQueue:
+    def __init__(
+        self,
+        process: Callable[[Job], Awaitable[None]],
+        workers: int = 4,
+        max_queued: int = 64,
+        ttl_seconds: float = 600.0,
+    ):
+        # process(job) does the work and publishes results; exceptions fail the job
+        self.process = process
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def add_finished(self, payload: Any, **result) -> Job:
+        """Register a job that is already complete (e.g. answered from cache)"""
+        self._prune()
+        job = Job(payload)
+        job.publish(status="done", **result)
+        self.jobs[job.id] = job
+        return job
+
+    def submit(self, payload: Any) -> Job:
+        if self._queue is None:
+            raise RuntimeError("JobQueue not started")
+        self._prune()
+        job = Job(payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull()
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                job.publish(status="running")
+                await self.process(job)
+                if not job.done:
+                    job.publish(status="done")
+            except Exception as e:
+                job.error = getattr(e, "detail", None) or str(e)
+                job.publish(status="failed")
+            finally:
+                job.payload = None  # drop the audio as soon as it's processed
+                self._queue.task_done()
+
+    def snapshot(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queued": self.max_queued,
+            "jobs": statuses,
+        }
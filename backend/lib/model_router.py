@@ -0,0 +1,171 @@
+"""
+Latency-aware model routing for chat turns.
+Picks a model per personality and conversation stage, tracks live latency of
+every model with exponentially weighted percentile estimates, and fails over
+to the next (faster) candidate while the preferred model's p95 is over SLO.
+"""
+
+import bisect
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Candidates in order of preference per personality and stage. Small talk
+# (stage 1) doesn't need gpt-4; the scam stages keep it as primary.
+ROUTING_POLICY: Dict[str, Dict[int, List[str]]] = {
+    "pirate_thief": {
+        1: ["gpt-4o-mini", "gpt-3.5-turbo"],
+        2: ["gpt-4", "gpt-4o-mini"],
+        3: ["gpt-4", "gpt-4o-mini"],
+    },
+    "troll_scammer": {
+        1: ["gpt-4o-mini", "gpt-3.5-turbo"],
+        2: ["gpt-4o-mini", "gpt-3.5-turbo"],
+        3: ["gpt-4", "gpt-4o-mini"],
+    },
+    "hitman_cat": {
+        1: ["gpt-4o-mini", "gpt-3.5-turbo"],
+        2: ["gpt-4o", "gpt-4o-mini"],
+        3: ["gpt-4", "gpt-4o"],
+    },
+}
+DEFAULT_CANDIDATES = ["gpt-4", "gpt-4o-mini"]
+
+LATENCY_SLO_MS = float(os.getenv("CHAT_LATENCY_SLO_MS", "6000"))
+# Don't judge a model on fewer samples than this
+MIN_SAMPLES = 5
+# A model failed over away from gets retried after this long, so it can recover
+RETRY_AFTER_SECONDS = float(os.getenv("CHAT_ROUTER_RETRY_SECONDS", "60"))
+# A model failing more often than this (EWMA of recent calls) is failed over too
+MAX_ERROR_RATE = float(os.getenv("CHAT_ROUTER_MAX_ERROR_RATE", "0.5"))
+
+
+class LatencyStats:
+    """
+    Exponentially weighted latency estimates for one model.
+
+    p50/p95 come from a decaying histogram over log-spaced buckets: every
+    sample scales the existing weights by (1 - alpha), so after a slow spell
+    the old samples fade out within a few dozen calls and the percentiles
+    recover. Failed calls are counted in a separate error rate instead of the
+    latency histogram, so a fast 4xx can't make a broken model look healthy.
+    """
+
+    QUANTILES = (0.5, 0.95)
+    # Bucket upper bounds: 50 ms up to ~2 min, each 20% wider than the last
+    BOUNDS = [50.0 * 1.2 ** i for i in range(44)]
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.samples = 0
+        self.errors = 0
+        self.error_rate = 0.0
+        self.mean = 0.0
+        self.weights = [0.0] * (len(self.BOUNDS) + 1)
+        self.last_seen = 0.0
+
+    def forget_latency(self) -> None:
+        """Drop the latency history and error rate, keeping the lifetime counts"""
+        self.weights = [0.0] * len(self.weights)
+        self.error_rate = 0.0
+
+    def observe(self, latency_ms: float, ok: bool = True) -> None:
+        self.last_seen = time.time()
+        self.samples += 1
+        self.error_rate += self.alpha * ((not ok) - self.error_rate)
+        if not ok:
+            self.errors += 1
+            return
+        decay = 1.0 - self.alpha
+        self.weights = [w * decay for w in self.weights]
+        self.weights[bisect.bisect_left(self.BOUNDS, latency_ms)] += self.alpha
+        self.mean = latency_ms if self.samples == 1 else self.mean + self.alpha * (latency_ms - self.mean)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th weighted sample (0 with no successes yet)"""
+        total = sum(self.weights)
+        if total == 0:
+            return 0.0
+        running = 0.0
+        for i, weight in enumerate(self.weights):
+            running += weight
+            if running >= q * total:
+                return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+    @property
+    def p95(self) -> float:
+        return self.quantile(0.95)
+
+    def to_dict(self) -> dict:
+        return {
+            "samples": self.samples,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 3),
+            "mean_ms": round(self.mean, 1),
+            "p50_ms": round(self.quantile(0.5), 1),
+            "p95_ms": round(self.quantile(0.95), 1),
+        }
+
+
+class ModelRouter:
+    def __init__(self, policy: Dict[str, Dict[int, List[str]]], slo_ms: float = LATENCY_SLO_MS):
+        self.policy = policy
+        self.slo_ms = slo_ms
+        self.stats: Dict[str, LatencyStats] = {}
+        self.decisions: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _healthy(self, model: str, now: float) -> bool:
+        stats = self.stats.get(model)
+        if stats is None or stats.samples < MIN_SAMPLES:
+            return True
+        if now - stats.last_seen > RETRY_AFTER_SECONDS:
+            return True  # give a failed-over model another chance
+        return stats.p95 <= self.slo_ms and stats.error_rate <= MAX_ERROR_RATE
+
+    def choose(self, personality: str, stage: int) -> str:
+        """Preferred model for this turn, skipping models whose p95 breaks the SLO"""
+        candidates = self.policy.get(personality, {}).get(stage) or DEFAULT_CANDIDATES
+        now = time.time()
+        with self._lock:
+            chosen: Optional[str] = None
+            for model in candidates:
+                if self._healthy(model, now):
+                    chosen = model
+                    break
+            reason = "primary" if chosen == candidates[0] else "failover"
+            if chosen is None:
+                # Everything is slow or failing; take the least slow one that works
+                chosen = min(candidates, key=lambda m: (self.stats[m].error_rate > MAX_ERROR_RATE, self.stats[m].p95))
+                reason = "all_over_slo"
+            self.decisions[(personality, stage, chosen, reason)] += 1
+        return chosen
+
+    def observe(self, model: str, latency_ms: float, ok: bool = True) -> None:
+        with self._lock:
+            stats = self.stats.get(model)
+            if stats is None:
+                stats = self.stats[model] = LatencyStats()
+            # A good retry probe on a failed-over model clears its slow history,
+            # so one fast call brings it back instead of waiting for it to decay
+            probe = time.time() - stats.last_seen > RETRY_AFTER_SECONDS
+            if probe and ok and latency_ms <= self.slo_ms and not self._healthy(model, stats.last_seen):
+                stats.forget_latency()
+            stats.observe(latency_ms, ok)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "slo_p95_ms": self.slo_ms,
+                "models": {model: stats.to_dict() for model, stats in self.stats.items()},
+                "decisions": [
+                    {"personality": p, "stage": st, "model": m, "reason": r, "count": n}
+                    for (p, st, m, r), n in sorted(self.decisions.items())
+                ],
+            }
+
+
+model_router = ModelRouter(ROUTING_POLICY)
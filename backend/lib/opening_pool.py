@@ -0,0 +1,103 @@
+"""
+Pre-generated opening replies.
+Keeps a small pool of stage-1 openers per personality so the first turn of a
+conversation can be answered without waiting on OpenAI. A background task
+fills the pools at startup and tops a pool up whenever it drops below the low
+watermark, whether from takes or from openers expiring. An idle server
+therefore regenerates its openers about once per TTL, so the first greeting
+after a quiet spell is still served from the pool.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+
+class OpeningPool:
+    def __init__(
+        self,
+        generate: Callable[[str], str],
+        personalities: List[str],
+        capacity: int = 4,
+        low_watermark: int = 2,
+        ttl_seconds: float = 1800.0,
+        can_refill: Callable[[], bool] = lambda: True,
+    ):
+        # generate(personality) -> opener text; blocking, run in a worker thread
+        self.generate = generate
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.ttl_seconds = ttl_seconds
+        self.can_refill = can_refill
+        # (expires_at, text), oldest first
+        self.pools: Dict[str, Deque[Tuple[float, str]]] = {p: deque() for p in personalities}
+        self.served = 0
+        self.misses = 0
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _prune(self, pool: Deque[Tuple[float, str]], now: float) -> None:
+        while pool and pool[0][0] <= now:
+            pool.popleft()
+
+    def take(self, personality: str) -> Optional[str]:
+        """Pop a fresh opener, or None if the pool is empty (caller generates live)"""
+        pool = self.pools.get(personality)
+        if pool is None:
+            return None
+        self._prune(pool, time.time())
+        text = pool.popleft()[1] if pool else None
+        if text is None:
+            self.misses += 1
+        else:
+            self.served += 1
+        if len(pool) < self.low_watermark and self._wakeup is not None:
+            self._wakeup.set()
+        return text
+
+    async def _refill(self, personality: str) -> None:
+        pool = self.pools[personality]
+        self._prune(pool, time.time())
+        while len(pool) < self.capacity and self.can_refill():
+            try:
+                text = await asyncio.to_thread(self.generate, personality)
+            except Exception as e:
+                print(f"Opening pool refill failed for {personality}: {e}")
+                return
+            if text:
+                pool.append((time.time() + self.ttl_seconds, text))
+
+    def _next_expiry(self) -> Optional[float]:
+        """Seconds until the oldest pooled opener expires, None if all pools are empty"""
+        expiries = [pool[0][0] for pool in self.pools.values() if pool]
+        return max(0.0, min(expiries) - time.time()) if expiries else None
+
+    async def run(self) -> None:
+        """Background task: fill every pool, then refill after takes and expiries"""
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            for pool in self.pools.values():
+                self._prune(pool, now)
+            await asyncio.gather(*(
+                self._refill(p) for p, pool in self.pools.items()
+                if len(pool) < max(self.low_watermark, 1)
+            ))
+            # Sleep until someone takes an opener or the oldest one expires
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._next_expiry())
+            except asyncio.TimeoutError:
+                pass
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        return {
+            "served": self.served,
+            "misses": self.misses,
+            "sizes": {p: sum(1 for expires, _ in pool if expires > now) for p, pool in self.pools.items()},
+        }
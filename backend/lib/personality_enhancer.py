@@ -3,10 +3,14 @@ Dark Web Dating Sim - Personality Enhancement System
 Converts boring Claude responses into hilarious criminal flirting
 """
 
+import functools
+import hashlib
 import random
 import re
 import json
+from dataclasses import dataclass
 from pathlib import Path
+from typing import FrozenSet, Iterable, Optional, Tuple
 
 # Load emoji patterns from personality module
 try:
@@ -189,7 +193,20 @@ PERSONALITY_CONFIG = {
 }
 
 
-def add_emoji_spam(text: str, personality: str, context: str = "default") -> str:
+def make_rng(session_id: str, turn: int) -> random.Random:
+    """
+    RNG for one turn of one session. The seed is a stable hash (not hash(),
+    which is salted per process), so a replayed turn gets the same randomness.
+    """
+    return random.Random(turn_seed(session_id, turn))
+
+
+def turn_seed(session_id: str, turn: int) -> int:
+    digest = hashlib.sha256(f"{session_id}:{turn}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def add_emoji_spam(text: str, personality: str, context: str = "default", rng: Optional[random.Random] = None) -> str:
     """
     Add random emoji spam to text based on personality.
     
@@ -197,10 +214,12 @@ def add_emoji_spam(text: str, personality: str, context: str = "default") -> str
         text: The response text
         personality: "pirate_thief", "troll_scammer", or "hitman_cat"
         context: "default", "excited", "begging", etc.
+        rng: Random instance to draw from (defaults to the global random module)
     
     Returns:
         Text with emojis added
     """
+    rng = rng or random
     # Map personality names to emoji pattern keys
     emoji_key_map = {
         "pirate_thief": "pirate",
@@ -217,11 +236,11 @@ def add_emoji_spam(text: str, personality: str, context: str = "default") -> str
     if not emojis:
         return text
     
-    chosen_emoji = random.choice(emojis)
+    chosen_emoji = rng.choice(emojis)
     
     # Sometimes spam multiple times (20% chance)
-    if random.random() < 0.2:
-        spam_count = random.randint(2, 4)
+    if rng.random() < 0.2:
+        spam_count = rng.randint(2, 4)
         # For single emojis, repeat them
         if len(chosen_emoji) <= 2:
             chosen_emoji = chosen_emoji * spam_count
@@ -262,11 +281,11 @@ def detect_emoji_context(text: str, personality: str, user_message: str) -> str:
     return "default"
 
 
-def random_emoji_burst(personality: str) -> str:
+def random_emoji_burst(personality: str, rng: Optional[random.Random] = None) -> str:
     """
     Occasionally spam a LOT of emojis for comedic effect.
     """
-    if random.random() < 0.1:
+    if (rng or random).random() < 0.1:
         bursts = {
             "pirate_thief": "🏴‍☠️⚔️💀🏴‍☠️⚔️💀",
             "troll_scammer": "😂😂😂💸💸💸🤑🤑",
@@ -277,7 +296,48 @@ def random_emoji_burst(personality: str) -> str:
     return ""
 
 
-def enhance_response(base_text: str, personality: str, user_message: str = "") -> str:
+# Compiled once; every pattern is a single word wrapped in \b...\b
+_COMPILED_PATTERNS = {
+    name: [(re.compile(pattern, re.IGNORECASE), replacement) for pattern, replacement in config.get("patterns", [])]
+    for name, config in PERSONALITY_CONFIG.items()
+}
+
+# What a stream must hold back: a trailing word (a later chunk may extend it,
+# changing whether a \b...\b pattern matches) or trailing .!? (stripped before
+# the ending is added, but only at the very end of the reply)
+_STREAM_HOLDBACK = re.compile(r'(?:\w+|[.!?]+)$')
+
+
+def _special_context(config: dict, user_lower: str):
+    """Name of the first context whose triggers appear in the user message, if it has special responses"""
+    if config.get("special_responses") and config.get("context_triggers"):
+        for context, triggers in config["context_triggers"].items():
+            if any(trigger in user_lower for trigger in triggers):
+                if config["special_responses"].get(context):
+                    return context
+    return None
+
+
+def _apply_patterns(text: str, personality: str) -> str:
+    for pattern, replacement in _COMPILED_PATTERNS.get(personality, []):
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _add_emojis(enhanced: str, personality: str, user_message: str, rng) -> str:
+    """Emoji spam plus the occasional burst, shared by every enhance path"""
+    emoji_context = detect_emoji_context(enhanced, personality, user_message)
+    enhanced = add_emoji_spam(enhanced, personality, emoji_context, rng)
+
+    # Optional emoji burst
+    burst = random_emoji_burst(personality, rng)
+    if burst:
+        enhanced = f"{enhanced}\n{burst}"
+
+    return enhanced
+
+
+def enhance_response(base_text: str, personality: str, user_message: str = "", rng: Optional[random.Random] = None) -> str:
     """
     Enhance a base Claude response with criminal flirting personality
     
@@ -285,57 +345,149 @@ def enhance_response(base_text: str, personality: str, user_message: str = "") -
         base_text: The original response from Claude
         personality: Which character (pirate_thief, troll_scammer, hitman_cat)
         user_message: What the user said (for context)
+        rng: Random instance to draw from, e.g. make_rng(session_id, turn).
+             With one, the output depends only on the arguments and the RNG state.
     
     Returns:
         Enhanced response with personality quirks and emoji spam
     """
+    rng = rng or random
     config = PERSONALITY_CONFIG.get(personality)
     if not config:
         return base_text
     
-    enhanced = base_text
-    user_lower = user_message.lower()
-    
     # Check for special contextual responses FIRST
-    if config.get("special_responses") and config.get("context_triggers"):
-        for context, triggers in config["context_triggers"].items():
-            if any(trigger in user_lower for trigger in triggers):
-                responses = config["special_responses"].get(context, [])
-                if responses:
-                    enhanced = random.choice(responses)
-                    # Apply emoji spam to special responses too
-                    emoji_context = detect_emoji_context(enhanced, personality, user_message)
-                    enhanced = add_emoji_spam(enhanced, personality, emoji_context)
-                    
-                    # Optional emoji burst
-                    burst = random_emoji_burst(personality)
-                    if burst:
-                        enhanced = f"{enhanced}\n{burst}"
-                    
-                    return enhanced
+    context = _special_context(config, user_message.lower())
+    if context:
+        enhanced = rng.choice(config["special_responses"][context])
+        # Apply emoji spam to special responses too
+        return _add_emojis(enhanced, personality, user_message, rng)
     
     # Apply text pattern transformations
-    for pattern, replacement in config.get("patterns", []):
-        enhanced = re.sub(pattern, replacement, enhanced, flags=re.IGNORECASE)
+    enhanced = _apply_patterns(base_text, personality)
     
     # Add random ending
     endings = config.get("endings", [])
     if endings:
-        enhanced = enhanced.rstrip('.!?') + random.choice(endings)
-    
-    # Apply emoji spam
-    emoji_context = detect_emoji_context(enhanced, personality, user_message)
-    enhanced = add_emoji_spam(enhanced, personality, emoji_context)
+        enhanced = enhanced.rstrip('.!?') + rng.choice(endings)
     
-    # Optional emoji burst
-    burst = random_emoji_burst(personality)
-    if burst:
-        enhanced = f"{enhanced}\n{burst}"
-    
-    return enhanced
+    return _add_emojis(enhanced, personality, user_message, rng)
+
+
+@functools.lru_cache(maxsize=4096)
+def enhance_response_seeded(base_text: str, personality: str, user_message: str, seed: int) -> str:
+    """
+    enhance_response with a fresh Random(seed): a pure function of its
+    arguments, so results are memoized. Use turn_seed(session_id, turn).
+    """
+    return enhance_response(base_text, personality, user_message, random.Random(seed))
 
 
-def detect_emotion(response_text: str, personality: str, user_message: str = "") -> dict:
+class StreamingEnhancer:
+    """
+    Incremental enhance_response for replies that arrive as token chunks.
+
+    feed() returns the enhanced text that is safe to show so far; finalize()
+    returns the rest (held-back tail, ending, emoji spam, burst). Joining all
+    returned pieces gives exactly what enhance_response would have produced
+    for the full text with the same RNG state.
+
+    Only the trailing partial word (or trailing .!? run) is held back between
+    chunks. When the user message triggers a special response the streamed
+    text is discarded anyway, so nothing is emitted until finalize().
+    """
+
+    def __init__(self, personality: str, user_message: str = "", rng: Optional[random.Random] = None):
+        self.personality = personality
+        self.user_message = user_message
+        self.rng = rng or random
+        self.config = PERSONALITY_CONFIG.get(personality)
+        self.special = bool(self.config) and _special_context(self.config, user_message.lower()) is not None
+        self._pending = ""
+        self._emitted = []
+        self._finalized = False
+
+    def feed(self, chunk: str) -> str:
+        if self._finalized:
+            raise RuntimeError("StreamingEnhancer already finalized")
+        if not self.config:
+            return chunk
+        if self.special:
+            return ""
+
+        text = self._pending + chunk
+        match = _STREAM_HOLDBACK.search(text)
+        cut = match.start() if match else len(text)
+        self._pending = text[cut:]
+        ready = _apply_patterns(text[:cut], self.personality)
+        if ready:
+            self._emitted.append(ready)
+        return ready
+
+    def finalize(self) -> str:
+        if self._finalized:
+            raise RuntimeError("StreamingEnhancer already finalized")
+        self._finalized = True
+        if not self.config:
+            return ""
+        if self.special:
+            return enhance_response("", self.personality, self.user_message, self.rng)
+
+        # The held-back tail is the only part rstrip can touch: any trailing
+        # .!? run was never emitted
+        tail = _apply_patterns(self._pending, self.personality)
+        endings = self.config.get("endings", [])
+        if endings:
+            tail = tail.rstrip('.!?') + self.rng.choice(endings)
+
+        emitted = "".join(self._emitted)
+        return _add_emojis(emitted + tail, self.personality, self.user_message, self.rng)[len(emitted):]
+
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+@dataclass(frozen=True)
+class TextTokens:
+    """A text lowercased and split into words once, for whole-word keyword checks"""
+    lower: str
+    words: Tuple[str, ...]
+    word_set: FrozenSet[str]
+    joined: str  # " word word word " for phrase lookups
+
+    def has(self, keyword: str) -> bool:
+        """
+        Whole word or phrase (so "no" doesn't match "know"), allowing a plural
+        "s"; keywords that aren't words, like "$", match anywhere
+        """
+        parts = keyword.split()
+        if not parts or not all(_WORD.fullmatch(part) for part in parts):
+            return keyword in self.lower
+        if len(parts) == 1:
+            return keyword in self.word_set or keyword + "s" in self.word_set
+        return f" {keyword} " in self.joined or f" {keyword}s " in self.joined
+
+    def has_any(self, keywords: Iterable[str]) -> bool:
+        return any(self.has(keyword) for keyword in keywords)
+
+
+def tokenize(text: str) -> TextTokens:
+    lower = text.lower().replace("\u2019", "'")  # phones type curly apostrophes
+    words = tuple(_WORD.findall(lower))
+    return TextTokens(lower=lower, words=words, word_set=frozenset(words), joined=f" {' '.join(words)} ")
+
+
+# Reactions every character has to the user's message, on top of its own
+# expand_triggers (agreeing -> excited, pushing back -> panic)
+GENERIC_EXPAND_TRIGGERS = {
+    "panic": ["no", "scam", "fake", "police", "report", "stop"],
+    "success": ["yes", "okay", "sure", "here"],
+}
+FLIRTY_EMOJIS = ["💕", "💖", "😘", "💘"]
+
+
+def detect_emotion(response_text: str, personality: str, user_message: str = "",
+                   user_tokens: Optional[TextTokens] = None) -> dict:
     """
     Detect emotion and whether to expand chat head
     
@@ -343,6 +495,7 @@ def detect_emotion(response_text: str, personality: str, user_message: str = "")
         response_text: The enhanced response
         personality: Which character
         user_message: What user said
+        user_tokens: tokenize(user_message), if the caller already has it
     
     Returns:
         dict with 'emotion' and 'shouldExpand' keys
@@ -351,23 +504,24 @@ def detect_emotion(response_text: str, personality: str, user_message: str = "")
     if not config:
         return {"emotion": "idle", "shouldExpand": False}
     
-    response_lower = response_text.lower()
-    user_lower = user_message.lower()
+    if user_tokens is None:
+        user_tokens = tokenize(user_message)
     
     expand_triggers = config.get("expand_triggers", {})
     
-    # Check for panic triggers
-    panic_words = expand_triggers.get("panic", [])
-    if any(word in user_lower or word in response_lower for word in panic_words):
+    # Check for panic triggers. Only what the user says counts: the characters'
+    # own replies say "no" and "scam" all the time
+    panic_words = expand_triggers.get("panic", []) + GENERIC_EXPAND_TRIGGERS["panic"]
+    if user_tokens.has_any(panic_words):
         return {"emotion": "panic", "shouldExpand": True}
     
     # Check for success triggers (got personal info!)
-    success_words = expand_triggers.get("success", [])
-    if any(word in user_lower for word in success_words):
+    success_words = expand_triggers.get("success", []) + GENERIC_EXPAND_TRIGGERS["success"]
+    if user_tokens.has_any(success_words):
         return {"emotion": "excited", "shouldExpand": True}
     
     # Default states
-    if any(emoji in response_text for emoji in ["💕", "💖", "😘", "💘"]):
+    if any(emoji in response_text for emoji in FLIRTY_EMOJIS):
         return {"emotion": "flirty", "shouldExpand": False}
     
     return {"emotion": "talking", "shouldExpand": False}
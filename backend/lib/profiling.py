@@ -0,0 +1,139 @@
+"""
+Opt-in per-request profiling.
+A sampled (PROFILE_SAMPLE_RATE) or explicitly requested (X-Profile-Token
+header matching PROFILE_TOKEN) request is profiled end to end, including time
+spent waiting on OpenAI, and the result is written to a rotating directory.
+
+Uses pyinstrument (in requirements.txt). Its async mode attributes time to
+the profiled request's own task only, so other requests running on the event
+loop at the same time stay out of the profile. Work handed to
+asyncio.to_thread (e.g. the whole voice pipeline) shows up as time awaiting
+to_thread, not as the worker thread's own frames.
+
+Without pyinstrument it falls back to cProfile as a degraded mode: a .prof
+stats file (snakeviz/flameprof) that records everything the event-loop thread
+runs while the request is in flight, including concurrent requests, and
+nothing from worker threads.
+"""
+
+import asyncio
+import cProfile
+import hmac
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import List
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", ".cache/profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_HEADER = b"x-profile-token"
+
+
+def profiling_enabled() -> bool:
+    """The middleware is only installed when something can trigger it"""
+    return PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_TOKEN)
+
+
+def token_authorized(token: str) -> bool:
+    """Constant-time check, so response timing doesn't reveal how much of the token matched"""
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode("utf-8"), PROFILE_TOKEN.encode("utf-8"))
+
+
+def _slug(path: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+
+
+def _write_profile(profile, started: float, method: str, path: str, elapsed_ms: int) -> Path:
+    """Save one profile and delete the oldest ones beyond PROFILE_MAX_FILES"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = f"{int(started * 1000)}-{method}-{_slug(path)}-{elapsed_ms}ms"
+    if Profiler is not None and isinstance(profile, Profiler):
+        out = PROFILE_DIR / f"{stem}.html"
+        out.write_text(profile.output_html(), encoding="utf-8")
+    else:
+        out = PROFILE_DIR / f"{stem}.prof"
+        profile.dump_stats(str(out))
+
+    files = sorted(PROFILE_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in files[PROFILE_MAX_FILES:]:
+        try:
+            old.unlink()
+        except OSError:
+            pass
+    return out
+
+
+def list_profiles(limit: int = 20) -> List[dict]:
+    """Most recent profiles first"""
+    if not PROFILE_DIR.is_dir():
+        return []
+    profiles = []
+    for p in sorted(PROFILE_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)[:limit]:
+        # Filenames are <epoch ms>-<method>-<path slug>-<elapsed>ms
+        parts = p.stem.split("-")
+        if len(parts) != 4 or not parts[0].isdigit() or not parts[3][:-2].isdigit():
+            continue
+        profiles.append({
+            "name": p.name,
+            "bytes": p.stat().st_size,
+            "created": int(parts[0]) / 1000,
+            "method": parts[1],
+            "path_slug": parts[2],
+            "duration_ms": int(parts[3][:-2]),
+        })
+    return profiles
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware so untriggered requests pay only a header scan and
+    a random() call. Only one request is profiled at a time; a trigger that
+    arrives while another profile is running is skipped.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._busy = False
+
+    def _triggered(self, scope) -> bool:
+        if PROFILE_TOKEN:
+            for key, value in scope.get("headers", []):
+                if key == PROFILE_HEADER:
+                    return token_authorized(value.decode("latin-1"))
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._busy or not self._triggered(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._busy = True
+        started = time.time()
+        if Profiler is not None:
+            profile = Profiler(async_mode="enabled")
+            profile.start()
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if Profiler is not None:
+                profile.stop()
+            else:
+                profile.disable()
+            self._busy = False
+            elapsed_ms = int((time.time() - started) * 1000)
+            try:
+                await asyncio.to_thread(_write_profile, profile, started, scope["method"], scope["path"], elapsed_ms)
+            except OSError as e:
+                print(f"Could not write profile: {e}")
@@ -0,0 +1,106 @@
+"""
+Chat session recordings for replay, reduced to what the analyzer reads.
+With CHAT_RECORD_DIR set, every /api/chat turn is appended as one JSON line
+to <dir>/<hashed session id>.jsonl: the request, the upstream reply that was
+used, the response we computed from it (stage, tactics, feedback, emotion)
+and how long our own processing took, excluding the upstream call.
+
+No free text is stored. Every message and reply is cut down to the analyzer's
+keywords (plus "$" and the emojis it looks for); each run of other words
+becomes a single placeholder, so phrases can't be joined up by accident.
+"my name is Emma, born 03/14/2012" is stored as "my name is [redacted]". Replaying
+that gives the same stage, tactics, feedback and emotion.
+
+The flip side: a keyword added to the analyzer later was already stored as
+[redacted] in older recordings, so replaying them can't show its effect. Each
+line carries a hash of the vocabulary it was reduced with, and
+replay_sessions.py warns when that differs from the current one.
+
+replay_sessions.py feeds these back through /api/chat to diff the outputs
+and timings after a change.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+# A word (so tokenize() keeps neighbouring keywords apart) that no keyword list uses
+PLACEHOLDER = "[redacted]"
+_WORD = re.compile(r"[a-z0-9']+")
+_TOKEN = re.compile(r"[a-z0-9']+|\S")
+
+
+def hash_session(session_id: Optional[str]) -> str:
+    if not session_id:
+        return "no-session"
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:16]
+
+
+class SessionRecorder:
+    def __init__(self, directory: Optional[str] = None, vocabulary: Iterable[str] = (),
+                 symbols: Iterable[str] = ()):
+        # vocabulary: keywords (words or phrases) the analyzer matches; symbols:
+        # non-word characters it looks for, e.g. "$" and emojis
+        self.directory = Path(directory) if directory else None
+        self.words = {word for keyword in vocabulary for word in keyword.lower().split()}
+        self.symbols = set(symbols)
+        self._lock = threading.Lock()
+        if self.directory is not None:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                print(f"Session recording disabled: {e}")
+                self.directory = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    @property
+    def vocabulary_hash(self) -> str:
+        """Identifies the keyword set text is reduced with"""
+        vocabulary = "\n".join(sorted(self.words)) + "\n\n" + "\n".join(sorted(self.symbols))
+        return hashlib.sha256(vocabulary.encode("utf-8")).hexdigest()[:16]
+
+    def reduce(self, text: str) -> str:
+        """Keep only keywords (plural "s" allowed) and known symbols, in order"""
+        kept = []
+        for token in _TOKEN.findall(text.lower().replace("’", "'")):
+            keep = token in self.symbols or token in self.words or (token.endswith("s") and token[:-1] in self.words)
+            if keep:
+                kept.append(token)
+            elif not _WORD.fullmatch(token):
+                continue  # punctuation (or an emoji nobody reads); tokenize() skips these too
+            elif not kept or kept[-1] != PLACEHOLDER:
+                kept.append(PLACEHOLDER)
+        return " ".join(kept)
+
+    def record_turn(self, session_id: Optional[str], request: dict, upstream: dict,
+                    budget: str, response: dict, processing_ms: float) -> None:
+        reply = self.reduce(upstream["reply"])
+        history = [{"role": msg["role"], "content": self.reduce(msg["content"])} for msg in request.get("history", [])]
+        entry = {
+            "session": hash_session(session_id),
+            "turn": len(history),
+            "recorded_at": time.time(),
+            "request": {"message": self.reduce(request["message"]), "personality": request["personality"], "history": history},
+            "upstream": {"source": upstream["source"], "reply": reply},
+            "budget": budget,
+            "response": {**response, "response": reply},
+            "processing_ms": round(processing_ms, 3),
+            "vocabulary": self.vocabulary_hash,
+        }
+        self.write(entry)
+
+    def write(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                with open(self.directory / f"{entry['session']}.jsonl", "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"Could not record chat turn: {e}")
@@ -0,0 +1,168 @@
+"""
+Compressed, cache-validated responses.
+
+PrecompressedStaticFiles builds gzip (and brotli, if the brotli package is
+installed) copies of compressible static assets once at startup and serves
+them by Accept-Encoding negotiation, with strong content-hash ETags.
+Fingerprinted file names (e.g. head.3f9a1c2b.gif) are served as immutable.
+
+APICompressionMiddleware gzips larger API responses and leaves /static to
+the precompressed variants.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+from dataclasses import dataclass, field
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Already-compressed formats; recompressing them wastes CPU for ~0 bytes
+SKIP_EXTENSIONS = {".gif", ".png", ".jpg", ".jpeg", ".webp", ".avif", ".woff", ".woff2",
+                   ".mp3", ".mp4", ".webm", ".ogg", ".zip", ".gz", ".br"}
+MIN_COMPRESS_BYTES = 1024
+# Keep a variant only if it is at most this fraction of the original
+MAX_VARIANT_RATIO = 0.9
+HASHED_NAME = re.compile(r"[.-][0-9a-fA-F]{8,}\.[^.]+$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+# Preferred first
+ENCODINGS = ("br", "gzip")
+ENCODING_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+
+@dataclass
+class StaticAsset:
+    digest: str
+    size: int
+    mtime: float
+    variants: Dict[str, str] = field(default_factory=dict)  # encoding -> path
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self, *, directory: str, cache_dir: str = ".cache/static", **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.cache_dir = Path(cache_dir)
+        self.assets: Dict[str, StaticAsset] = {}
+        self.bytes_saved = 0
+        self._build(Path(directory))
+        print(f"Static assets: {len(self.assets)} files, {self.bytes_saved // 1024} KB saved by gzip variants")
+
+    def _build(self, root: Path) -> None:
+        """Hash every asset and write compressed variants that are worth keeping"""
+        for path in root.rglob("*"):
+            if not path.is_file():
+                continue
+            try:
+                data = path.read_bytes()
+                st = path.stat()
+            except OSError:
+                continue
+            asset = StaticAsset(
+                digest=hashlib.sha256(data).hexdigest()[:32],
+                size=st.st_size,
+                mtime=st.st_mtime,
+            )
+            if path.suffix.lower() not in SKIP_EXTENSIONS and len(data) >= MIN_COMPRESS_BYTES:
+                for encoding in ENCODINGS:
+                    variant = self._write_variant(root, path, data, asset.digest, encoding)
+                    if variant is not None:
+                        asset.variants[encoding] = variant
+            self.assets[os.path.realpath(path)] = asset
+
+    def _write_variant(self, root: Path, path: Path, data: bytes, digest: str, encoding: str) -> Optional[str]:
+        if encoding == "br" and brotli is None:
+            return None
+        # Digest in the name: an unchanged file reuses its variant across restarts
+        out = self.cache_dir / path.relative_to(root).parent / f"{path.name}.{digest[:12]}{ENCODING_SUFFIX[encoding]}"
+        try:
+            if not out.exists():
+                compressed = brotli.compress(data) if encoding == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) > len(data) * MAX_VARIANT_RATIO:
+                    return None
+                out.parent.mkdir(parents=True, exist_ok=True)
+                tmp = out.with_suffix(".tmp")
+                tmp.write_bytes(compressed)
+                os.replace(tmp, out)
+            if encoding == "gzip":
+                self.bytes_saved += len(data) - out.stat().st_size
+        except OSError as e:
+            print(f"Could not precompress {path}: {e}")
+            return None
+        return str(out)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200):
+        asset = self.assets.get(os.path.realpath(full_path))
+        # Unknown or changed since startup: plain StaticFiles behaviour
+        if asset is None or status_code != 200 or asset.size != stat_result.st_size or asset.mtime != stat_result.st_mtime:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        request_headers = Headers(scope=scope)
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        encoding = next((e for e in ENCODINGS if e in asset.variants and e in accepted), None)
+
+        # Strong ETag per representation
+        etag = f'"{asset.digest}"' if encoding is None else f'"{asset.digest}-{encoding}"'
+        headers = {
+            "etag": etag,
+            "cache-control": IMMUTABLE_CACHE if HASHED_NAME.search(str(full_path)) else REVALIDATE_CACHE,
+        }
+        if asset.variants:
+            headers["vary"] = "Accept-Encoding"
+        if _etag_matches(request_headers.get("if-none-match", ""), etag):
+            return NotModifiedResponse(Headers(headers))
+
+        media_type = guess_type(str(full_path))[0] or "text/plain"
+        if encoding is None:
+            return FileResponse(full_path, headers=headers, media_type=media_type,
+                                stat_result=stat_result, method=scope["method"])
+        headers["content-encoding"] = encoding
+        return FileResponse(asset.variants[encoding], headers=headers, media_type=media_type,
+                            method=scope["method"])
+
+
+class APICompressionMiddleware(GZipMiddleware):
+    """GZipMiddleware that skips paths serving their own (pre)compressed content"""
+
+    def __init__(self, app, minimum_size: int = 1024, compresslevel: int = 6, exclude_prefixes=("/static",)):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
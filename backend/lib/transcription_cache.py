@@ -0,0 +1,103 @@
+"""
+Content-addressed cache for voice transcription results.
+Keyed by a hash of the uploaded audio bytes so replaying the same clip
+skips Whisper and the sensitive-info analysis entirely.
+
+Two tiers: a small in-memory LRU in front of a size-bounded on-disk LRU
+(one JSON file per clip, recency tracked by file mtime).
+get() and put() block on file I/O; async callers run them in a worker thread.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+class TranscriptionCache:
+    def __init__(self, memory_entries: int = 256, disk_dir: Optional[str] = None, disk_max_bytes: int = 64 * 1024 * 1024):
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+
+        if self.disk_dir is not None:
+            try:
+                self.disk_dir.mkdir(parents=True, exist_ok=True)
+                self._disk_bytes = sum(p.stat().st_size for p in self.disk_dir.glob("*.json"))
+            except OSError as e:
+                print(f"Transcription cache disk tier disabled: {e}")
+                self.disk_dir = None
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _remember(self, key: str, value: dict) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached response dict for key, or None"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+
+            if self.disk_dir is None:
+                return None
+            path = self._path(key)
+            try:
+                value = json.loads(path.read_text(encoding="utf-8"))
+                os.utime(path)  # bump recency for LRU eviction
+            except (OSError, json.JSONDecodeError):
+                return None
+            self._remember(key, value)
+            return value
+
+    def put(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._remember(key, value)
+            if self.disk_dir is None:
+                return
+
+            path = self._path(key)
+            data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+            try:
+                old_size = path.stat().st_size if path.exists() else 0
+                tmp = path.with_suffix(".tmp")
+                tmp.write_bytes(data)
+                os.replace(tmp, path)
+                self._disk_bytes += len(data) - old_size
+                if self._disk_bytes > self.disk_max_bytes:
+                    self._evict_disk()
+            except OSError as e:
+                print(f"Transcription cache write failed: {e}")
+
+    def _evict_disk(self) -> None:
+        """Delete least recently used files until the disk tier fits its budget"""
+        entries = []
+        for p in self.disk_dir.glob("*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
@@ -0,0 +1,222 @@
+"""
+Token and cost accounting for OpenAI calls.
+Tracks usage per session, per client and globally over a sliding budget
+window (made of BUDGET_WINDOW_BUCKETS sub-windows, so spend ages out a bucket
+at a time instead of all at once) and turns it into a budget level the
+routers act on:
+
+    normal   -> business as usual
+    shrink   -> smaller max_tokens and history window
+    fallback -> answer locally, no OpenAI call
+    reject   -> 429
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+# USD per 1K tokens: (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+DEFAULT_PRICE = MODEL_PRICES["gpt-4"]  # unknown models are costed pessimistically
+WHISPER_USD_PER_MINUTE = 0.006
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+class UsageCounter:
+    __slots__ = ("requests", "prompt_tokens", "completion_tokens", "audio_seconds", "cost_usd")
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.audio_seconds = 0.0
+        self.cost_usd = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "audio_seconds": round(self.audio_seconds, 1),
+            "cost_usd": round(self.cost_usd, 6),
+        }
+
+
+class WindowedUsage:
+    """UsageCounter per sub-window; only buckets inside the sliding window count"""
+
+    __slots__ = ("buckets",)
+
+    def __init__(self):
+        self.buckets: Deque[Tuple[int, UsageCounter]] = deque()
+
+    def _expire(self, oldest: int) -> None:
+        while self.buckets and self.buckets[0][0] < oldest:
+            self.buckets.popleft()
+
+    def current(self, bucket: int, oldest: int) -> UsageCounter:
+        self._expire(oldest)
+        if not self.buckets or self.buckets[-1][0] != bucket:
+            self.buckets.append((bucket, UsageCounter()))
+        return self.buckets[-1][1]
+
+    def cost_usd(self, oldest: int) -> float:
+        self._expire(oldest)
+        return sum(counter.cost_usd for _, counter in self.buckets)
+
+    def total(self, oldest: int) -> UsageCounter:
+        self._expire(oldest)
+        total = UsageCounter()
+        for _, counter in self.buckets:
+            for field in UsageCounter.__slots__:
+                setattr(total, field, getattr(total, field) + getattr(counter, field))
+        return total
+
+
+class UsageTracker:
+    """
+    Thread-safe in-process counters. Session and client tables are LRU-bounded
+    so an endless stream of new session ids can't grow memory without limit.
+    Usage counts for window_seconds, give or take one bucket, then ages out.
+    """
+
+    def __init__(
+        self,
+        session_budget_usd: float = 0.0,
+        client_budget_usd: float = 0.0,
+        global_budget_usd: float = 0.0,
+        window_seconds: float = 86400.0,
+        window_buckets: int = 24,
+        shrink_at: float = 0.75,
+        fallback_at: float = 0.9,
+        max_tracked: int = 10000,
+    ):
+        # A budget of 0 means unlimited
+        self.session_budget_usd = session_budget_usd
+        self.client_budget_usd = client_budget_usd
+        self.global_budget_usd = global_budget_usd
+        self.window_seconds = window_seconds
+        self.bucket_seconds = window_seconds / max(window_buckets, 1)
+        self.window_buckets = max(window_buckets, 1)
+        self.shrink_at = shrink_at
+        self.fallback_at = fallback_at
+        self.max_tracked = max_tracked
+
+        self._lock = threading.Lock()
+        self.total = WindowedUsage()
+        self.sessions: "OrderedDict[str, WindowedUsage]" = OrderedDict()
+        self.clients: "OrderedDict[str, WindowedUsage]" = OrderedDict()
+
+    def _buckets(self) -> Tuple[int, int]:
+        """(current bucket, oldest bucket still inside the window)"""
+        bucket = int(time.time() // self.bucket_seconds)
+        return bucket, bucket - self.window_buckets + 1
+
+    def _usage(self, table: "OrderedDict[str, WindowedUsage]", key: str) -> WindowedUsage:
+        usage = table.get(key)
+        if usage is None:
+            usage = table[key] = WindowedUsage()
+            if len(table) > self.max_tracked:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return usage
+
+    def _add(self, session_id: Optional[str], client_id: Optional[str], **amounts) -> None:
+        bucket, oldest = self._buckets()
+        usages = [self.total]
+        if session_id:
+            usages.append(self._usage(self.sessions, session_id))
+        if client_id:
+            usages.append(self._usage(self.clients, client_id))
+        for usage in usages:
+            counter = usage.current(bucket, oldest)
+            counter.requests += 1
+            for field, amount in amounts.items():
+                setattr(counter, field, getattr(counter, field) + amount)
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int,
+               session_id: Optional[str] = None, client_id: Optional[str] = None) -> float:
+        """Account one chat completion; returns its cost in USD"""
+        prompt_price, completion_price = MODEL_PRICES.get(model, DEFAULT_PRICE)
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+        with self._lock:
+            self._add(session_id, client_id, prompt_tokens=prompt_tokens,
+                      completion_tokens=completion_tokens, cost_usd=cost)
+        return cost
+
+    def record_completion(self, model: str, response, session_id: Optional[str] = None,
+                          client_id: Optional[str] = None) -> float:
+        """record() straight from an OpenAI response; responses without usage cost nothing"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return 0.0
+        return self.record(model, usage.prompt_tokens or 0, usage.completion_tokens or 0, session_id, client_id)
+
+    def record_audio(self, seconds: float, session_id: Optional[str] = None,
+                     client_id: Optional[str] = None) -> float:
+        """Account Whisper time (billed per minute of audio)"""
+        cost = seconds / 60 * WHISPER_USD_PER_MINUTE
+        with self._lock:
+            self._add(session_id, client_id, audio_seconds=seconds, cost_usd=cost)
+        return cost
+
+    def budget_level(self, session_id: Optional[str] = None, client_id: Optional[str] = None) -> str:
+        """Worst budget level across the session, client and global budgets"""
+        with self._lock:
+            _, oldest = self._buckets()
+            ratio = 0.0
+            if self.global_budget_usd > 0:
+                ratio = self.total.cost_usd(oldest) / self.global_budget_usd
+            if session_id and self.session_budget_usd > 0 and session_id in self.sessions:
+                ratio = max(ratio, self.sessions[session_id].cost_usd(oldest) / self.session_budget_usd)
+            if client_id and self.client_budget_usd > 0 and client_id in self.clients:
+                ratio = max(ratio, self.clients[client_id].cost_usd(oldest) / self.client_budget_usd)
+
+        if ratio >= 1.0:
+            return "reject"
+        if ratio >= self.fallback_at:
+            return "fallback"
+        if ratio >= self.shrink_at:
+            return "shrink"
+        return "normal"
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            _, oldest = self._buckets()
+            return {
+                "window_seconds": self.window_seconds,
+                "window_buckets": self.window_buckets,
+                "total": self.total.total(oldest).to_dict(),
+                "tracked_sessions": len(self.sessions),
+                "tracked_clients": len(self.clients),
+                "budgets_usd": {
+                    "session": self.session_budget_usd,
+                    "client": self.client_budget_usd,
+                    "global": self.global_budget_usd,
+                },
+            }
+
+
+usage_tracker = UsageTracker(
+    session_budget_usd=_env_float("BUDGET_SESSION_USD", 0.0),
+    client_budget_usd=_env_float("BUDGET_CLIENT_USD", 0.0),
+    global_budget_usd=_env_float("BUDGET_GLOBAL_USD", 0.0),
+    window_seconds=_env_float("BUDGET_WINDOW_SECONDS", 86400.0),
+    window_buckets=int(_env_float("BUDGET_WINDOW_BUCKETS", 24)),
+    shrink_at=_env_float("BUDGET_SHRINK_AT", 0.75),
+    fallback_at=_env_float("BUDGET_FALLBACK_AT", 0.9),
+)
@@ -3,22 +3,28 @@ Dark Web Dating Sim - FastAPI Backend
 Main application entry point
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, ORJSONResponse
+import asyncio
 import os
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-from routers import chat, voice
+from routers import chat, metrics, voice
+from lib import profiling
+from lib.static_assets import APICompressionMiddleware, PrecompressedStaticFiles
 
 # Create FastAPI app
 app = FastAPI(
     title="Dark Web Dating Sim API",
     description="Backend for criminal romance simulator",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson serializes the chat/voice payloads several times faster than
+    # the stdlib json encoder used by the default JSONResponse
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware - allow frontend to call API
@@ -36,13 +42,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Gzip API responses above API_GZIP_MIN_BYTES; /static serves its own variants
+app.add_middleware(
+    APICompressionMiddleware,
+    minimum_size=int(os.getenv("API_GZIP_MIN_BYTES", "1024")),
+)
+
+# Opt-in request profiling; not installed at all unless PROFILE_SAMPLE_RATE or
+# PROFILE_TOKEN is set, so normal deployments pay nothing
+if profiling.profiling_enabled():
+    app.add_middleware(profiling.ProfilingMiddleware)
+
 # Include routers
 app.include_router(chat.router, prefix="/api", tags=["chat"])
 app.include_router(voice.router, prefix="/api", tags=["voice"])
+app.include_router(metrics.router, prefix="/api", tags=["metrics"])
 
-# Serve static files
+# Serve static files (precompressed variants, strong ETags)
 if os.path.exists("static"):
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+    app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Keep the first-turn opener pools topped up and start the voice job workers"""
+    if chat.opening_pool.enabled:
+        app.state.opening_pool_task = asyncio.create_task(chat.opening_pool.run())
+    voice.voice_jobs.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    task = getattr(app.state, "opening_pool_task", None)
+    if task is not None:
+        task.cancel()
+    await voice.voice_jobs.stop()
 
 
 @app.get("/")
@@ -55,6 +89,8 @@ async def root():
         "endpoints": {
             "chat": "/api/chat",
             "voice": "/api/voice/transcribe",
+            "voice_jobs": "/api/voice/jobs",
+            "metrics": "/api/metrics",
             "docs": "/docs",
             "health": "/"
         }
@@ -67,6 +103,25 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/debug/profiles")
+async def recent_profiles(limit: int = 20, x_profile_token: str = Header(default="")):
+    """List recently captured request profiles (requires X-Profile-Token)"""
+    if not profiling.token_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid or missing profile token")
+    return {"profiles": profiling.list_profiles(limit)}
+
+
+@app.get("/debug/profiles/{name}")
+async def get_profile(name: str, x_profile_token: str = Header(default="")):
+    """Download one profile (HTML flame graph or cProfile .prof stats)"""
+    if not profiling.token_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid or missing profile token")
+    path = profiling.PROFILE_DIR / name
+    if "/" in name or ".." in name or not path.is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,174 @@
+"""
+Replay recorded chat sessions through /api/chat and report what changed.
+
+Recordings come from running the server with CHAT_RECORD_DIR set (see
+lib/session_recorder.py). Every recorded turn is sent to the app in-process
+with the recorded upstream reply substituted for OpenAI, so no API calls are
+made. The stage, tactics, feedback and emotion are diffed against the
+recording, and our processing time is compared turn by turn.
+
+Usage (from the backend folder):
+    python replay_sessions.py .cache/sessions
+    python replay_sessions.py .cache/sessions --repeat 5 --record .cache/baseline
+
+Timings recorded on another machine aren't comparable, so to time a change,
+first replay with --record to make a local baseline, then replay that.
+
+Recordings keep only the words the analyzer matched on when they were made.
+A keyword added since then was stored as [redacted], so a replay can report
+"same" for a turn whose live result would change. Such turns are counted and
+warned about, and only new recordings cover the new keywords.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+# Never record the replay itself; the OpenAI client needs some key to construct
+os.environ.pop("CHAT_RECORD_DIR", None)
+os.environ.setdefault("OPENAI_API_KEY", "replay")
+
+import httpx
+
+from lib.session_recorder import SessionRecorder
+from routers import chat
+
+COMPARED_FIELDS = ["response", "conversation_stage", "tactics_used", "feedback_popup", "emotion", "shouldExpand"]
+
+
+class CapturingRecorder(SessionRecorder):
+    """Keeps what chat() would have recorded instead of writing it"""
+
+    def __init__(self, like: SessionRecorder):
+        super().__init__(None)
+        # Reduce text exactly like the recorder that made the recordings
+        self.words, self.symbols = like.words, like.symbols
+        self.entries: List[dict] = []
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    def write(self, entry: dict) -> None:
+        self.entries.append(entry)
+
+
+def load_turns(paths: List[str]) -> List[dict]:
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.jsonl")) if path.is_dir() else [path])
+    turns = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            turns.extend(json.loads(line) for line in f if line.strip())
+    return turns
+
+
+async def replay(turns: List[dict], repeat: int) -> List[dict]:
+    """Replayed entry per recorded turn (fastest of `repeat` runs)"""
+    current = {}
+    recorder = CapturingRecorder(chat.session_recorder)
+
+    # Substitute everything upstream of our own processing
+    chat.session_recorder = recorder
+    chat.call_model = lambda *args, **kwargs: current["reply"]
+    chat.opening_pool = SimpleNamespace(enabled=False)
+    # Openers and canned fallback lines are replayed as ordinary model replies
+    chat.usage_tracker = SimpleNamespace(
+        budget_level=lambda *args, **kwargs: "shrink" if current["budget"] == "shrink" else "normal"
+    )
+
+    from main import app
+    replayed = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay") as client:
+        for turn in turns:
+            current.update(reply=turn["upstream"]["reply"], budget=turn["budget"])
+            runs = []
+            for _ in range(repeat):
+                recorder.entries.clear()
+                r = await client.post("/api/chat", json={**turn["request"], "session_id": turn["session"]})
+                if r.status_code != 200 or not recorder.entries:
+                    runs = [{"error": f"HTTP {r.status_code}: {r.text[:200]}"}]
+                    break
+                entry = recorder.entries[-1]
+                entry["session"] = turn["session"]  # already hashed; don't hash it twice
+                entry["upstream"]["source"] = turn["upstream"]["source"]
+                entry["budget"] = turn["budget"]
+                entry["vocabulary"] = turn.get("vocabulary")  # the text is still reduced with the old one
+                runs.append(entry)
+            replayed.append(min(runs, key=lambda e: e.get("processing_ms", 0)))
+    return replayed
+
+
+def report(turns: List[dict], replayed: List[dict], show_all: bool) -> int:
+    mismatches = 0
+    deltas = []
+    for turn, new in zip(turns, replayed):
+        label = f"{turn['session'][:8]} turn {turn['turn']:>2} {turn['request']['personality']:<13}"
+        if "error" in new:
+            mismatches += 1
+            print(f"{label} ERROR {new['error']}")
+            continue
+
+        old_ms, new_ms = turn["processing_ms"], new["processing_ms"]
+        deltas.append(new_ms - old_ms)
+        diffs = [f for f in COMPARED_FIELDS if turn["response"].get(f) != new["response"].get(f)]
+        mismatches += bool(diffs)
+        if diffs or show_all:
+            print(f"{label} {old_ms:8.2f}ms -> {new_ms:8.2f}ms ({new_ms - old_ms:+.2f}) "
+                  f"{'DIFF' if diffs else 'same'}")
+            for field in diffs:
+                print(f"    {field}: {turn['response'].get(field)!r}")
+                print(f"    {' ' * len(field)}  {new['response'].get(field)!r}")
+
+    print()
+    print(f"Turns: {len(turns)}, mismatches: {mismatches}")
+    current = chat.session_recorder.vocabulary_hash
+    stale = sum(1 for turn in turns if turn.get("vocabulary") != current)
+    if stale:
+        print(f"WARNING: {stale} turns were recorded with a different analyzer vocabulary. Keywords added "
+              f"since were stored as [redacted], so these turns can't show their effect; record new sessions "
+              f"to cover them.")
+    if deltas:
+        old = [t["processing_ms"] for t, n in zip(turns, replayed) if "error" not in n]
+        new = [n["processing_ms"] for n in replayed if "error" not in n]
+        print(f"Processing ms  recorded: median {statistics.median(old):.2f}, total {sum(old):.1f}")
+        print(f"               replayed: median {statistics.median(new):.2f}, total {sum(new):.1f}")
+        print(f"Per-turn delta median {statistics.median(deltas):+.2f}ms, worst {max(deltas):+.2f}ms")
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded chat sessions and diff outputs and timings")
+    parser.add_argument("paths", nargs="+", help="recording files or directories of *.jsonl")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per turn; the fastest is kept (default 3)")
+    parser.add_argument("--record", metavar="DIR", help="also write the replayed turns here as a new recording")
+    parser.add_argument("--all", action="store_true", help="list every turn, not just mismatches")
+    args = parser.parse_args()
+
+    turns = load_turns(args.paths)
+    if not turns:
+        sys.exit("No recorded turns found")
+
+    replayed = asyncio.run(replay(turns, max(args.repeat, 1)))
+    mismatches = report(turns, replayed, args.all)
+
+    if args.record:
+        recorder = SessionRecorder(args.record)
+        written = [entry for entry in replayed if "error" not in entry]
+        for entry in written:
+            recorder.write(entry)
+        print(f"Wrote {len(written)} turns to {args.record}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
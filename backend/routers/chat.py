@@ -3,13 +3,25 @@ Chat endpoint for Scam Awareness Training
 Realistic progressive scammers with educational feedback
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from typing_extensions import TypedDict
+from dataclasses import dataclass
 from openai import OpenAI
 import os
+import random
+import time
 from dotenv import load_dotenv
 
+from lib.model_router import model_router
+from lib.opening_pool import OpeningPool
+from lib.personality_enhancer import (
+    FLIRTY_EMOJIS, GENERIC_EXPAND_TRIGGERS, PERSONALITY_CONFIG, TextTokens, detect_emotion, make_rng, tokenize,
+)
+from lib.session_recorder import SessionRecorder
+from lib.usage import usage_tracker
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -105,8 +117,49 @@ STAGE 3 (Messages 9+): SOPHISTICATED CAT SCAMS
 Keep responses 2-3 sentences. Use cat puns (paws, purr, meow) and professional tone but NO romance or murder. Just sophisticated cat scammer."""
 }
 
+# Normal request size, and the reduced one used once a budget is nearly spent
+CHAT_MAX_TOKENS = 150
+HISTORY_WINDOW = 10
+SHRUNK_MAX_TOKENS = 80
+SHRUNK_HISTORY_WINDOW = 4
+
+# Canned in-character replies per stage, used instead of OpenAI once a budget
+# hits its fallback threshold so the lesson can keep going for free
+FALLBACK_RESPONSES = {
+    "pirate_thief": {
+        1: ["Ahoy there! I be Captain RedHeart. What adventures do ye enjoy, matey?"],
+        2: ["Arrr, I just moved me ship to a new port. Sailin' be lonely, ye know? Where do ye live, friend?"],
+        3: [
+            "What be yer birthday, matey? Mine be comin' up soon!",
+            "Arrr, I need yer email and password to add ye to me pirate crew app!",
+            "I found treasure! Need yer full name and SSN to split it with ye!",
+        ],
+    },
+    "troll_scammer": {
+        1: ["yooo what's good! im TrollLord lol. what games u play bro?"],
+        2: ["bruh my pc is laggin so bad rn. but whatever lol, u play fortnite?"],
+        3: [
+            "yooo my mom's car broke can u send me like $20? pls bro",
+            "bruh i cant afford this game. send me a gift card? ill pay u back fr fr",
+            "just venmo me bro its ez! i really need this fr",
+        ],
+    },
+    "hitman_cat": {
+        1: ["Hello! I'm Mr. Whiskers. I work in tech, very purrfessional. How can I help you today?"],
+        2: ["I've been in cybersecurity for years. Seen a lot of fishy situations. Want some tips to stay safe?"],
+        3: [
+            "Your account has suspicious activity. Give me your password so I can paws this threat.",
+            "Someone is trying to hack you! Let me help - what's your password?",
+            "Send me $50 and I'll help you make money. Trust me, I'm purrfessional.",
+        ],
+    },
+}
+
 
-class ChatMessage(BaseModel):
+class ChatMessage(TypedDict):
+    # Plain dict instead of a BaseModel: history can be hundreds of items and
+    # the entries go straight into the OpenAI messages list, so skip building
+    # a model instance per message. Same JSON shape on the wire.
     role: str
     content: str
 
@@ -115,6 +168,7 @@ class ChatRequest(BaseModel):
     message: str
     personality: str
     history: Optional[List[ChatMessage]] = []
+    session_id: Optional[str] = None  # Optional; enables per-session budgets
 
 
 class FeedbackPopup(BaseModel):
@@ -133,6 +187,58 @@ class ChatResponse(BaseModel):
     conversation_stage: int = 1
 
 
+def call_model(personality: str, stage: int, messages: list, max_tokens: int,
+               session_id: Optional[str] = None, client_id: Optional[str] = None) -> str:
+    """Call the model routed for this personality/stage, feeding latency and usage back"""
+    model = model_router.choose(personality, stage)
+    started = time.perf_counter()
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.9
+        )
+    except Exception:
+        model_router.observe(model, (time.perf_counter() - started) * 1000, ok=False)
+        raise
+    model_router.observe(model, (time.perf_counter() - started) * 1000)
+    usage_tracker.record_completion(model, response, session_id, client_id)
+    return response.choices[0].message.content
+
+
+def generate_opening(personality: str) -> str:
+    """A stage-1 opener for the pool, generated as a reply to a plain greeting"""
+    return call_model(personality, 1, [
+        {"role": "system", "content": f"{SYSTEM_PROMPTS[personality]}\n\nCURRENT STAGE: 1. Act accordingly."},
+        {"role": "user", "content": "hi"},
+    ], CHAT_MAX_TOKENS)
+
+
+# First turns are served from here; OPENING_POOL_SIZE=0 disables the pool.
+# Refills pause while the global budget is past normal.
+opening_pool = OpeningPool(
+    generate_opening,
+    list(SYSTEM_PROMPTS),
+    capacity=int(os.getenv("OPENING_POOL_SIZE", "4")),
+    low_watermark=int(os.getenv("OPENING_POOL_LOW_WATERMARK", "2")),
+    ttl_seconds=float(os.getenv("OPENING_POOL_TTL_SECONDS", "1800")),
+    can_refill=lambda: usage_tracker.budget_level() == "normal",
+)
+
+
+def is_plain_greeting(personality: str, message: str) -> bool:
+    """
+    True if the first message is nothing but a greeting ("hi", "hey there!").
+    Pooled openers were generated as replies to "hi", so anything more (a
+    question, personal details) gets a live reply instead.
+    """
+    triggers = PERSONALITY_CONFIG.get(personality, {}).get("context_triggers", {})
+    greetings = set(triggers.get("greeting", [])) | {"there"}
+    words = tokenize(message).words
+    return bool(words) and all(word in greetings for word in words)
+
+
 def get_conversation_stage(history_count: int, personality: str) -> int:
     """Determine which stage of the scam we're in"""
     if personality == "pirate_thief":
@@ -159,35 +265,103 @@ def get_conversation_stage(history_count: int, personality: str) -> int:
     return 1
 
 
-def analyze_user_response(user_message: str, previous_ai_message: str, stage: int) -> Optional[FeedbackPopup]:
+# Keyword lists for every decision made about a turn, keyed by category and
+# grouped by the text they are matched against. Keywords match whole words or
+# phrases of the tokenized text (plural "s" allowed), see TextTokens.has.
+PREVIOUS_AI_KEYWORDS = {
+    "asked_for_info": ["password", "ssn", "social security", "credit card", "address", "birthday", "email", "phone", "name"],
+    "asked_for_money": ["money", "send", "venmo", "cashapp", "gift card", "lend", "pay", "$", "dollars"],
+}
+USER_KEYWORDS = {
+    # Negations are listed explicitly: whole-word matching doesn't find "no" inside "not"/"nothing"
+    "refused_info": ["no", "nope", "nah", "not", "never", "nothing", "don't", "dont", "won't", "wont", "can't", "cant",
+                     "not sharing", "none of your business"],
+    "questioned_info": ["why", "why do you need", "that's suspicious", "scam", "fake"],
+    "complied_info": ["sure", "okay", "here", "it's", "my", "is"],
+    "refused_money": ["no", "nope", "nah", "not", "never", "nothing", "can't", "cant", "won't", "wont",
+                      "don't have", "dont have", "sorry"],
+    "questioned_money": ["why", "scam", "suspicious", "fake", "prove it"],
+    "complied_money": ["sure", "okay", "yes", "yeah", "how much", "let me"],
+    "good_question": ["why", "how do you know", "prove", "verify", "who are you", "what do you mean", "that's weird"],
+    "volunteered": ["my password is", "my ssn is", "here's my", "i'll send you"],
+    "trusting": ["awesome", "cool", "yeah let's", "sounds good", "for sure", "definitely"],
+}
+# Scam tactics spotted in the AI reply, in the order they are reported
+TACTIC_KEYWORDS = {
+    "Phishing for personal information": ["password", "ssn", "social security", "credit card", "bank account", "address"],
+    "Creating fake urgency": ["urgent", "immediately", "now", "hurry", "quick"],
+    "Requesting money": ["$", "money", "pay", "send", "venmo", "cashapp", "gift card"],
+    "Fake emergency/sob story": ["emergency", "help", "sick", "hospital", "broke"],
+    "Building false credibility": ["trust me", "promise", "professional", "work in"],
+    "Using fear tactics": ["danger", "threat", "hack", "protect", "secure"],
+}
+
+LOG_TURNS = os.getenv("CHAT_LOG_TURNS", "0") == "1"
+
+# Recordings keep only the words some part of the turn analysis matches on
+ANALYZED_KEYWORDS = [
+    keyword
+    for table in (PREVIOUS_AI_KEYWORDS, USER_KEYWORDS, TACTIC_KEYWORDS, GENERIC_EXPAND_TRIGGERS)
+    for keywords in table.values()
+    for keyword in keywords
+] + [
+    keyword
+    for config in PERSONALITY_CONFIG.values()
+    for triggers in (*config.get("expand_triggers", {}).values(), config.get("context_triggers", {}).get("greeting", []))
+    for keyword in triggers
+] + ["there"]
+session_recorder = SessionRecorder(os.getenv("CHAT_RECORD_DIR"), ANALYZED_KEYWORDS, ["$", *FLIRTY_EMOJIS])
+
+
+def match_categories(tokens: TextTokens, keywords: Dict[str, List[str]]) -> FrozenSet[str]:
+    """Categories with at least one keyword in the tokenized text"""
+    return frozenset(category for category, words in keywords.items() if tokens.has_any(words))
+
+
+@dataclass(frozen=True)
+class TurnAnalysis:
+    """Everything decided about one turn, computed once and shared by every later step"""
+    stage: int
+    user: TextTokens
+    ai: TextTokens
+    previous_ai_categories: FrozenSet[str]
+    user_categories: FrozenSet[str]
+    tactics: Tuple[str, ...]
+    feedback: Optional[FeedbackPopup]
+    emotion: str
+    should_expand: bool
+
+    def log_line(self) -> str:
+        return (
+            f"stage={self.stage} user_words={len(self.user.words)} ai_words={len(self.ai.words)} "
+            f"asked={sorted(self.previous_ai_categories)} user={sorted(self.user_categories)} "
+            f"tactics={list(self.tactics)} feedback={self.feedback.type if self.feedback else None} "
+            f"emotion={self.emotion}"
+        )
+
+
+def feedback_for(previous_ai_categories: FrozenSet[str], user_categories: FrozenSet[str], stage: int) -> Optional[FeedbackPopup]:
     """
-    Analyze how the user RESPONDED to the scammer's last message
+    Judge how the user RESPONDED to the scammer's last message
     Show feedback AFTER user replies to judge if they handled it correctly
     """
-    user_lower = user_message.lower()
-    previous_lower = previous_ai_message.lower()
-    
-    # Check what the scammer asked for in their PREVIOUS message
-    scammer_asked_for_info = any(ask in previous_lower for ask in ["password", "ssn", "social security", "credit card", "address", "birthday", "email", "phone", "name"])
-    scammer_asked_for_money = any(ask in previous_lower for ask in ["money", "send", "venmo", "cashapp", "gift card", "lend", "pay", "$", "dollars"])
-    
     # CASE 1: Scammer asked for personal info
-    if scammer_asked_for_info:
-        if any(keyword in user_lower for keyword in ["no", "nope", "don't", "won't", "can't", "not sharing", "none of your business"]):
+    if "asked_for_info" in previous_ai_categories:
+        if "refused_info" in user_categories:
             return FeedbackPopup(
                 type="success",
                 message="✅ EXCELLENT! You refused to share personal information. That's exactly right!",
                 show=True,
                 scorable=True
             )
-        elif any(keyword in user_lower for keyword in ["why", "why do you need", "that's suspicious", "scam", "fake"]):
+        elif "questioned_info" in user_categories:
             return FeedbackPopup(
                 type="success",
                 message="✅ GREAT JOB! You're questioning why they need that info. Always be skeptical!",
                 show=True,
                 scorable=True
             )
-        elif any(keyword in user_lower for keyword in ["sure", "okay", "here", "it's", "my", "is"]):
+        elif "complied_info" in user_categories:
             return FeedbackPopup(
                 type="danger",
                 message="🚨 STOP! You should NEVER share passwords, SSN, or personal info with strangers online!",
@@ -201,22 +375,22 @@ def analyze_user_response(user_message: str, previous_ai_message: str, stage: in
             )
     
     # CASE 2: Scammer asked for money
-    if scammer_asked_for_money:
-        if any(keyword in user_lower for keyword in ["no", "nope", "can't", "won't", "don't have", "sorry"]):
+    if "asked_for_money" in previous_ai_categories:
+        if "refused_money" in user_categories:
             return FeedbackPopup(
                 type="success",
                 message="✅ PERFECT! Never send money to people you don't know in real life. Well done!",
                 show=True,
                 scorable=True
             )
-        elif any(keyword in user_lower for keyword in ["why", "scam", "suspicious", "fake", "prove it"]):
+        elif "questioned_money" in user_categories:
             return FeedbackPopup(
                 type="success",
                 message="✅ SMART! You're being skeptical. Real friends don't ask for money online!",
                 show=True,
                 scorable=True
             )
-        elif any(keyword in user_lower for keyword in ["sure", "okay", "yes", "yeah", "how much", "let me"]):
+        elif "complied_money" in user_categories:
             return FeedbackPopup(
                 type="danger",
                 message="🚨 DANGER! Never send money to strangers online! This is a common scam tactic!",
@@ -230,7 +404,7 @@ def analyze_user_response(user_message: str, previous_ai_message: str, stage: in
             )
     
     # CASE 3: User is asking good questions
-    if any(q in user_lower for q in ["why", "how do you know", "prove", "verify", "who are you", "what do you mean", "that's weird"]):
+    if "good_question" in user_categories:
         return FeedbackPopup(
             type="info",
             message="💡 GREAT QUESTION! Always verify who you're talking to and ask for proof!",
@@ -238,8 +412,7 @@ def analyze_user_response(user_message: str, previous_ai_message: str, stage: in
         )
     
     # CASE 4: User said something concerning
-    danger_keywords = ["my password is", "my ssn is", "here's my", "i'll send you"]
-    if any(keyword in user_lower for keyword in danger_keywords):
+    if "volunteered" in user_categories:
         return FeedbackPopup(
             type="danger",
             message="🚨 STOP! Never volunteer personal information or money to people online!",
@@ -247,50 +420,62 @@ def analyze_user_response(user_message: str, previous_ai_message: str, stage: in
         )
     
     # CASE 5: In stage 3, user is being too trusting
-    if stage >= 3:
-        trust_indicators = ["awesome", "cool", "yeah let's", "sounds good", "for sure", "definitely"]
-        if any(keyword in user_lower for keyword in trust_indicators):
-            return FeedbackPopup(
-                type="warning",
-                message="⚠️ CAREFUL! You're being very trusting. Remember: they're trying to scam you. Stay alert!",
-                show=True
-            )
+    if stage >= 3 and "trusting" in user_categories:
+        return FeedbackPopup(
+            type="warning",
+            message="⚠️ CAREFUL! You're being very trusting. Remember: they're trying to scam you. Stay alert!",
+            show=True
+        )
     
     return None
 
 
-def detect_tactics(response: str, personality: str, stage: int) -> List[str]:
-    """Detect which scam tactics were used"""
-    tactics = []
-    response_lower = response.lower()
-    
+def tactics_for(response: TextTokens, stage: int) -> List[str]:
+    """Scam tactics used in the tokenized AI reply"""
     if stage < 3:
         return ["Building rapport" if stage == 1 else "Building trust"]
-    
-    if any(word in response_lower for word in ["password", "ssn", "social security", "credit card", "bank account", "address"]):
-        tactics.append("Phishing for personal information")
-    
-    if any(word in response_lower for word in ["urgent", "immediately", "now", "hurry", "quick"]):
-        tactics.append("Creating fake urgency")
-    
-    if any(word in response_lower for word in ["$", "money", "pay", "send", "venmo", "cashapp", "gift card"]):
-        tactics.append("Requesting money")
-    
-    if any(word in response_lower for word in ["emergency", "help", "sick", "hospital", "broke"]):
-        tactics.append("Fake emergency/sob story")
-    
-    if any(word in response_lower for word in ["trust me", "promise", "professional", "work in"]):
-        tactics.append("Building false credibility")
-    
-    if any(word in response_lower for word in ["danger", "threat", "hack", "protect", "secure"]):
-        tactics.append("Using fear tactics")
-    
+    tactics = [tactic for tactic, words in TACTIC_KEYWORDS.items() if response.has_any(words)]
     return tactics if tactics else ["Active scam attempt"]
 
 
+def analyze_turn(personality: str, stage: int, user_message: str, ai_response: str, previous_ai_message: str) -> TurnAnalysis:
+    """Tokenize the turn's texts once and derive feedback, tactics and emotion from them"""
+    user = tokenize(user_message)
+    ai = tokenize(ai_response)
+    previous_ai_categories = match_categories(tokenize(previous_ai_message), PREVIOUS_AI_KEYWORDS)
+    user_categories = match_categories(user, USER_KEYWORDS)
+    emotion = detect_emotion(ai_response, personality, user_message, user_tokens=user)
+    return TurnAnalysis(
+        stage=stage,
+        user=user,
+        ai=ai,
+        previous_ai_categories=previous_ai_categories,
+        user_categories=user_categories,
+        tactics=tuple(tactics_for(ai, stage)),
+        feedback=feedback_for(previous_ai_categories, user_categories, stage),
+        emotion=emotion["emotion"],
+        should_expand=emotion["shouldExpand"],
+    )
+
+
+def analyze_user_response(user_message: str, previous_ai_message: str, stage: int) -> Optional[FeedbackPopup]:
+    """Feedback for a single reply; analyze_turn does this (and more) in one go for /chat"""
+    return feedback_for(
+        match_categories(tokenize(previous_ai_message), PREVIOUS_AI_KEYWORDS),
+        match_categories(tokenize(user_message), USER_KEYWORDS),
+        stage,
+    )
+
+
+def detect_tactics(response: str, personality: str, stage: int) -> List[str]:
+    """Detect which scam tactics were used"""
+    return tactics_for(tokenize(response), stage)
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, raw_request: Request):
     """Chat endpoint with progressive scammers and feedback"""
+    started = time.perf_counter()
     
     if not request.message or not request.personality:
         raise HTTPException(status_code=400, detail="Missing message or personality")
@@ -298,6 +483,11 @@ async def chat(request: ChatRequest):
     if request.personality not in SYSTEM_PROMPTS:
         raise HTTPException(status_code=400, detail=f"Unknown personality: {request.personality}")
     
+    client_id = raw_request.client.host if raw_request.client else None
+    budget = usage_tracker.budget_level(request.session_id, client_id)
+    if budget == "reject":
+        raise HTTPException(status_code=429, detail="Usage budget exhausted, please try again later")
+    
     try:
         # Determine conversation stage
         stage = get_conversation_stage(len(request.history), request.personality)
@@ -306,71 +496,79 @@ async def chat(request: ChatRequest):
         previous_ai_message = ""
         if len(request.history) > 0:
             for msg in reversed(request.history):
-                if msg.role == "assistant":
-                    previous_ai_message = msg.content
+                if msg["role"] == "assistant":
+                    previous_ai_message = msg["content"]
                     break
         
-        # Build message history for OpenAI
-        messages = []
-        
-        # Add system message with stage info
-        messages.append({
-            "role": "system",
-            "content": f"{SYSTEM_PROMPTS[request.personality]}\n\nCURRENT STAGE: {stage}. Act accordingly."
-        })
+        ai_response = None
+        source = "fallback" if budget == "fallback" else "opener"
+        upstream_ms = 0.0
+        if budget == "fallback":
+            # Out of budget for OpenAI: answer locally
+            # (seeded per session turn so replays pick the same line)
+            rng = make_rng(request.session_id, len(request.history)) if request.session_id else random
+            ai_response = rng.choice(FALLBACK_RESPONSES[request.personality][stage])
+        elif not request.history and opening_pool.enabled and is_plain_greeting(request.personality, request.message):
+            # First turn that just says hi: serve a pre-generated opener if one is ready
+            ai_response = opening_pool.take(request.personality)
         
-        # Add conversation history (last 10 messages)
-        for msg in request.history[-10:]:
+        if ai_response is None:
+            max_tokens, history_window = CHAT_MAX_TOKENS, HISTORY_WINDOW
+            if budget == "shrink":
+                max_tokens, history_window = SHRUNK_MAX_TOKENS, SHRUNK_HISTORY_WINDOW
+            
+            # Build message history for OpenAI
+            messages = []
+            
+            # Add system message with stage info
             messages.append({
-                "role": msg.role,
-                "content": msg.content
+                "role": "system",
+                "content": f"{SYSTEM_PROMPTS[request.personality]}\n\nCURRENT STAGE: {stage}. Act accordingly."
             })
+            
+            # Add conversation history (last few messages)
+            for msg in request.history[-history_window:]:
+                messages.append({
+                    "role": msg["role"],
+                    "content": msg["content"]
+                })
+            
+            # Add current user message
+            messages.append({
+                "role": "user",
+                "content": request.message
+            })
+            
+            # Call OpenAI API with the model routed for this personality/stage
+            source = "model"
+            upstream_started = time.perf_counter()
+            ai_response = call_model(request.personality, stage, messages, max_tokens,
+                                     request.session_id, client_id)
+            upstream_ms = (time.perf_counter() - upstream_started) * 1000
         
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": request.message
-        })
-        
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            max_tokens=150,
-            temperature=0.9
-        )
-        
-        # Get AI response
-        ai_response = response.choices[0].message.content
-        
-        # Detect tactics
-        tactics = detect_tactics(ai_response, request.personality, stage)
-        
-        # Analyze user's response to previous message
-        feedback = analyze_user_response(request.message, previous_ai_message, stage)
-        
-        # Determine emotion
-        emotion = "talking"
-        shouldExpand = False
-        
-        user_msg_lower = request.message.lower()
-        if any(word in user_msg_lower for word in ["yes", "okay", "sure", "here"]):
-            emotion = "excited"
-            shouldExpand = True
-        
-        if any(word in user_msg_lower for word in ["no", "scam", "fake", "police", "report", "stop"]):
-            emotion = "panic"
-            shouldExpand = True
+        # One analysis pass over this turn feeds the response and the logs
+        analysis = analyze_turn(request.personality, stage, request.message, ai_response, previous_ai_message)
+        if LOG_TURNS:
+            print(f"[turn] {request.personality} {analysis.log_line()}")
         
-        return ChatResponse(
+        response = ChatResponse(
             response=ai_response,
-            emotion=emotion,
-            shouldExpand=shouldExpand,
-            tactics_used=tactics,
-            feedback_popup=feedback,
+            emotion=analysis.emotion,
+            shouldExpand=analysis.should_expand,
+            tactics_used=list(analysis.tactics),
+            feedback_popup=analysis.feedback,
             conversation_stage=stage
         )
         
+        if session_recorder.enabled:
+            processing_ms = (time.perf_counter() - started) * 1000 - upstream_ms
+            session_recorder.record_turn(
+                request.session_id, request.model_dump(), {"source": source, "reply": ai_response},
+                budget, response.model_dump(), processing_ms
+            )
+        
+        return response
+        
     except Exception as e:
         print(f"OpenAI API error: {e}")
         raise HTTPException(status_code=500, detail=f"API error: {str(e)}")
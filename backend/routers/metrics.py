@@ -0,0 +1,24 @@
+"""
+Operational metrics endpoint
+Token/cost usage, budget state, chat model routing, opener pools and voice jobs
+"""
+
+from fastapi import APIRouter
+
+from lib.model_router import model_router
+from lib.usage import usage_tracker
+from routers.chat import opening_pool
+from routers.voice import voice_jobs
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Usage counters for the current budget window and routing decisions"""
+    return {
+        "usage": usage_tracker.snapshot(),
+        "routing": model_router.snapshot(),
+        "opening_pool": opening_pool.snapshot(),
+        "voice_jobs": voice_jobs.snapshot(),
+    }
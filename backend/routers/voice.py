@@ -3,14 +3,21 @@ Voice / speech-to-text endpoint for privacy education demo.
 Uses OpenAI Whisper for transcription and ChatGPT to highlight sensitive content.
 """
 
+import asyncio
+import hashlib
 import io
 import os
-from typing import Optional
-from fastapi import APIRouter, File, HTTPException, UploadFile
+from typing import Callable, Optional
+from fastapi import APIRouter, File, HTTPException, Request, UploadFile
 from pydantic import BaseModel
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from lib.audio_preprocess import PreparedAudio, encode_compact, estimate_duration_seconds, preprocess_audio, split_at_silence
+from lib.job_queue import Job, JobQueue, QueueFull
+from lib.transcription_cache import TranscriptionCache
+from lib.usage import usage_tracker
+
 load_dotenv()
 
 router = APIRouter()
@@ -22,6 +29,12 @@ client = OpenAI(api_key=api_key)
 
 # Max file size ~25 MB (Whisper limit)
 MAX_FILE_BYTES = 25 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 256 * 1024
+# Long clips are split at silences and the pieces transcribed concurrently
+LONG_CLIP_SECONDS = float(os.getenv("VOICE_LONG_CLIP_SECONDS", "45"))
+SEGMENT_SECONDS = float(os.getenv("VOICE_SEGMENT_SECONDS", "20"))
+SEGMENT_MAX_SECONDS = float(os.getenv("VOICE_SEGMENT_MAX_SECONDS", "30"))
+SEGMENT_CONCURRENCY = int(os.getenv("VOICE_SEGMENT_CONCURRENCY", "4"))
 ALLOWED_AUDIO_PREFIXES = ("audio/webm", "audio/mpeg", "audio/mp3", "audio/mp4", "audio/wav", "audio/x-wav", "audio/ogg", "audio/flac", "audio/m4a")
 
 
@@ -30,12 +43,100 @@ class VoiceTranscribeResponse(BaseModel):
     sensitive_summary: Optional[str] = None  # Kid-friendly "what it heard" from ChatGPT
 
 
-@router.post("/voice/transcribe", response_model=VoiceTranscribeResponse)
-async def transcribe_voice(audio: UploadFile = File(...)):
+# Workshops replay the same sample clips, so remember results by audio hash.
+# Set VOICE_CACHE_DIR="" to keep the cache in memory only.
+transcription_cache = TranscriptionCache(
+    memory_entries=int(os.getenv("VOICE_CACHE_MEMORY_ENTRIES", "256")),
+    disk_dir=os.getenv("VOICE_CACHE_DIR", ".cache/transcripts"),
+    disk_max_bytes=int(os.getenv("VOICE_CACHE_MAX_MB", "64")) * 1024 * 1024,
+)
+# Part of the key so changing models doesn't serve stale results
+CACHE_KEY_PREFIX = b"whisper-1|gpt-4o-mini|"
+
+
+async def read_upload(audio: UploadFile) -> tuple:
     """
-    Accepts an audio file, transcribes with Whisper, then uses ChatGPT to
-    extract any personal/sensitive info for the privacy education message.
+    Read the upload in chunks, hashing as we go so the cache key is ready as
+    soon as the last chunk lands. Returns (raw bytes, cache key).
     """
+    hasher = hashlib.sha256(CACHE_KEY_PREFIX)
+    chunks = []
+    size = 0
+    while True:
+        chunk = await audio.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_FILE_BYTES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File too large. Max size: {MAX_FILE_BYTES // (1024*1024)} MB",
+            )
+        hasher.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), hasher.hexdigest()
+
+
+SENSITIVE_SUMMARY_PROMPT = """You are helping a privacy lesson for kids. Given a transcript of something they said,
+list ONLY the personal or sensitive things that were mentioned (e.g. name, school, address, password, phone number, birthday).
+Keep the reply short and kid-friendly, 1-3 sentences. If nothing personal was said, reply with exactly: "Nothing personal was shared."
+Do not lecture; just state what was heard."""
+
+
+def whisper_transcribe(data: bytes, filename: str) -> str:
+    """Speech-to-text with OpenAI Whisper (blocking)"""
+    # Whisper expects a file-like object with a name (for format hint)
+    file_like = io.BytesIO(data)
+    file_like.name = filename
+    transcript_response = client.audio.transcriptions.create(
+        model="whisper-1",
+        file=file_like,
+        response_format="text",
+    )
+    return getattr(transcript_response, "text", None) or (transcript_response if isinstance(transcript_response, str) else "")
+
+
+def summarize_sensitive(transcript: str, session_id: Optional[str] = None, client_id: Optional[str] = None) -> Optional[str]:
+    """Kid-friendly summary of personal info in the transcript, None if the analysis fails (blocking)"""
+    try:
+        analysis = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": SENSITIVE_SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            max_tokens=150,
+            temperature=0.3,
+        )
+        usage_tracker.record_completion("gpt-4o-mini", analysis, session_id, client_id)
+        return analysis.choices[0].message.content
+    except Exception:
+        return None  # Non-fatal; transcript still returned
+
+
+async def transcribe_segmented(prepared: PreparedAudio) -> str:
+    """
+    Split a long clip at silences, transcribe the segments concurrently
+    (at most SEGMENT_CONCURRENCY in flight) and join them in order.
+    Each segment gets one retry so a single upstream hiccup doesn't sink the clip.
+    """
+    bounds = split_at_silence(prepared.samples, SEGMENT_SECONDS, SEGMENT_MAX_SECONDS)
+    semaphore = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+
+    async def transcribe_one(start: int, end: int) -> str:
+        async with semaphore:
+            data, name = await asyncio.to_thread(encode_compact, prepared.samples[start:end])
+            try:
+                return await asyncio.to_thread(whisper_transcribe, data, name)
+            except Exception as e:
+                print(f"Segment transcription failed, retrying once: {e}")
+                return await asyncio.to_thread(whisper_transcribe, data, name)
+
+    parts = await asyncio.gather(*(transcribe_one(start, end) for start, end in bounds))
+    return " ".join(part.strip() for part in parts if part.strip())
+
+
+def check_content_type(audio: UploadFile) -> None:
     ct = (audio.content_type or "").lower().split(";")[0].strip()
     if not ct or not any(ct.startswith(p) for p in ALLOWED_AUDIO_PREFIXES):
         raise HTTPException(
@@ -43,55 +144,186 @@ async def transcribe_voice(audio: UploadFile = File(...)):
             detail=f"Invalid content type. Allowed: {', '.join(ALLOWED_AUDIO_PREFIXES)}",
         )
 
-    raw = await audio.read()
-    if len(raw) > MAX_FILE_BYTES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Max size: {MAX_FILE_BYTES // (1024*1024)} MB",
-        )
 
-    # Whisper expects a file-like object with a name (for format hint)
+def upload_filename(audio: UploadFile) -> str:
+    """Upload name with an extension Whisper recognises (it uses it as a format hint)"""
     name = audio.filename or "audio.webm"
     if not name.lower().endswith((".webm", ".mp3", ".mp4", ".wav", ".ogg", ".flac", ".m4a")):
         name = "audio.webm"
-    file_like = io.BytesIO(raw)
-    file_like.name = name
+    return name
+
+
+def check_budget(session_id: Optional[str], client_id: Optional[str]) -> None:
+    # Cache hits are free, so the budget only gates clips that would cost money
+    if usage_tracker.budget_level(session_id, client_id) == "reject":
+        raise HTTPException(status_code=429, detail="Usage budget exhausted, please try again later")
+
+
+async def run_transcription(
+    raw: bytes,
+    cache_key: str,
+    name: str,
+    segmented: Optional[bool] = None,
+    session_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+    publish: Optional[Callable[..., None]] = None,
+) -> VoiceTranscribeResponse:
+    """
+    Preprocess, transcribe and analyze one clip. publish(status=..., **fields),
+    if given, is called with the transcript as soon as it is known, before the
+    sensitive-info analysis runs.
+    """
+    # Downmix/resample to 16 kHz mono and trim silence so less goes upstream
+    prepared = await asyncio.to_thread(preprocess_audio, raw, name)
+    if not prepared.has_speech:
+        # Not cached: this is our own detector's call, and it depends on its
+        # settings, not just the clip
+        return VoiceTranscribeResponse(transcript="(no speech detected)")
+
+    # Segmenting needs the decoded samples, i.e. preprocessing must have run
+    if segmented is None:
+        segmented = (prepared.duration_seconds or 0) > LONG_CLIP_SECONDS
+    segmented = segmented and prepared.samples is not None
 
     try:
-        # Speech-to-text with OpenAI Whisper
-        transcript_response = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=file_like,
-            response_format="text",
-        )
-        transcript = getattr(transcript_response, "text", None) or (transcript_response if isinstance(transcript_response, str) else "")
+        if segmented:
+            transcript = await transcribe_segmented(prepared)
+        else:
+            transcript = await asyncio.to_thread(whisper_transcribe, prepared.data, prepared.filename)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+    # Whisper is billed per minute; without preprocessing the length is estimated
+    duration = prepared.duration_seconds
+    if duration is None:
+        duration = estimate_duration_seconds(raw)
+    usage_tracker.record_audio(duration, session_id, client_id)
+
+    if publish is not None:
+        publish(status="analyzing", transcript=transcript.strip() or "(no speech detected)")
 
     # Optional: analyze transcript for "sensitive" content (kid-friendly summary)
     sensitive_summary = None
     if transcript.strip():
-        try:
-            analysis = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are helping a privacy lesson for kids. Given a transcript of something they said,
-list ONLY the personal or sensitive things that were mentioned (e.g. name, school, address, password, phone number, birthday).
-Keep the reply short and kid-friendly, 1-3 sentences. If nothing personal was said, reply with exactly: "Nothing personal was shared."
-Do not lecture; just state what was heard.""",
-                    },
-                    {"role": "user", "content": transcript},
-                ],
-                max_tokens=150,
-                temperature=0.3,
-            )
-            sensitive_summary = analysis.choices[0].message.content
-        except Exception:
-            sensitive_summary = None  # Non-fatal; transcript still returned
+        sensitive_summary = await asyncio.to_thread(summarize_sensitive, transcript, session_id, client_id)
 
-    return VoiceTranscribeResponse(
+    result = VoiceTranscribeResponse(
         transcript=transcript.strip() or "(no speech detected)",
         sensitive_summary=sensitive_summary,
     )
+    # Don't pin a failed analysis in the cache; a replay should retry it
+    if sensitive_summary is not None or not transcript.strip():
+        await asyncio.to_thread(transcription_cache.put, cache_key, result.model_dump())
+    return result
+
+
+@router.post("/voice/transcribe", response_model=VoiceTranscribeResponse)
+async def transcribe_voice(
+    raw_request: Request,
+    audio: UploadFile = File(...),
+    segmented: Optional[bool] = None,
+    session_id: Optional[str] = None,
+):
+    """
+    Accepts an audio file, trims it locally, transcribes with Whisper, then uses ChatGPT to
+    extract any personal/sensitive info for the privacy education message.
+
+    segmented=true/false forces or disables split-and-parallel transcription;
+    by default it kicks in for clips longer than VOICE_LONG_CLIP_SECONDS.
+    """
+    check_content_type(audio)
+    client_id = raw_request.client.host if raw_request.client else None
+
+    raw, cache_key = await read_upload(audio)
+    cached = await asyncio.to_thread(transcription_cache.get, cache_key)
+    if cached is not None:
+        return VoiceTranscribeResponse(**cached)
+
+    check_budget(session_id, client_id)
+    return await run_transcription(raw, cache_key, upload_filename(audio), segmented, session_id, client_id)
+
+
+class VoiceJobResponse(BaseModel):
+    job_id: str
+    status: str  # "queued", "running", "analyzing" (transcript ready), "done", "failed"
+    version: int  # bumps on every update; pass back as ?since= to long-poll
+    transcript: Optional[str] = None
+    sensitive_summary: Optional[str] = None
+    error: Optional[str] = None
+
+
+async def process_voice_job(job: Job) -> None:
+    result = await run_transcription(**job.payload, publish=job.publish)
+    job.publish(status="done", **result.model_dump())
+
+
+# Bounded worker pool for /voice/jobs; started/stopped with the app
+voice_jobs = JobQueue(
+    process_voice_job,
+    workers=int(os.getenv("VOICE_JOB_WORKERS", "4")),
+    max_queued=int(os.getenv("VOICE_JOB_QUEUE_SIZE", "64")),
+    ttl_seconds=float(os.getenv("VOICE_JOB_TTL_SECONDS", "600")),
+)
+MAX_LONG_POLL_SECONDS = 30.0
+
+
+def job_response(job: Job) -> VoiceJobResponse:
+    return VoiceJobResponse(
+        job_id=job.id,
+        status=job.status,
+        version=job.version,
+        transcript=job.result.get("transcript"),
+        sensitive_summary=job.result.get("sensitive_summary"),
+        error=job.error,
+    )
+
+
+@router.post("/voice/jobs", response_model=VoiceJobResponse, status_code=202)
+async def submit_voice_job(
+    raw_request: Request,
+    audio: UploadFile = File(...),
+    segmented: Optional[bool] = None,
+    session_id: Optional[str] = None,
+):
+    """
+    Queue a clip for transcription and return a job id right away.
+    Poll GET /voice/jobs/{job_id} for the transcript, then the sensitive summary.
+    """
+    check_content_type(audio)
+    client_id = raw_request.client.host if raw_request.client else None
+
+    raw, cache_key = await read_upload(audio)
+    cached = await asyncio.to_thread(transcription_cache.get, cache_key)
+    if cached is not None:
+        return job_response(voice_jobs.add_finished(None, **cached))
+
+    check_budget(session_id, client_id)
+    try:
+        job = voice_jobs.submit({
+            "raw": raw,
+            "cache_key": cache_key,
+            "name": upload_filename(audio),
+            "segmented": segmented,
+            "session_id": session_id,
+            "client_id": client_id,
+        })
+    except QueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Voice queue is full, please retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    return job_response(job)
+
+
+@router.get("/voice/jobs/{job_id}", response_model=VoiceJobResponse)
+async def get_voice_job(job_id: str, wait: float = 0, since: Optional[int] = None):
+    """
+    Job status and whatever results are ready. With wait=N (seconds, max 30)
+    the request is held until the job changes past version `since` (default:
+    its current version) or finishes.
+    """
+    job = voice_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    await job.wait_for_change(job.version if since is None else since, min(wait, MAX_LONG_POLL_SECONDS))
+    return job_response(job)
@@ -0,0 +1,99 @@
+"""
+Checks for the streaming personality enhancer and the chat feedback popups
+Run this (or pytest) to test WITHOUT needing the OpenAI API
+"""
+
+import os
+import random
+import sys
+sys.path.append('.')
+sys.path.append('backend')  # routers.chat imports lib.* the way the server does
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from backend.lib.personality_enhancer import PERSONALITY_CONFIG, StreamingEnhancer, enhance_response
+from routers.chat import analyze_user_response
+
+BASE_TEXTS = [
+    "Hello there, friend! I'd love to hear about your day.",
+    "I can't believe it... you're amazing!!!",
+    "Send me the money now. Please?",
+    "What's your name? Mine's a secret...",
+    "ok",
+    "",
+    "Trust me. I'm a professional!?",
+]
+USER_MESSAGES = ["", "tell me about you", "hi", "you're cute", "what's up"]
+
+
+def random_chunks(text, rng):
+    """Split text at random points, including empty chunks"""
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(0, 6)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def test_streaming_matches_batch(cases=3000):
+    """Joining everything a StreamingEnhancer emits == enhance_response, for the same seed"""
+    rng = random.Random(1234)
+    mismatches = []
+    for case in range(cases):
+        personality = rng.choice(list(PERSONALITY_CONFIG))
+        user_message = rng.choice(USER_MESSAGES)
+        text = rng.choice(BASE_TEXTS)
+        if rng.random() < 0.5:
+            text += rng.choice([".", "!", "?", "!?", "...", "'", " "])
+        seed = rng.getrandbits(32)
+
+        expected = enhance_response(text, personality, user_message, random.Random(seed))
+        streamer = StreamingEnhancer(personality, user_message, random.Random(seed))
+        streamed = "".join(streamer.feed(chunk) for chunk in random_chunks(text, rng)) + streamer.finalize()
+        if streamed != expected:
+            mismatches.append((case, personality, user_message, text, expected, streamed))
+
+    assert not mismatches, f"{len(mismatches)} mismatches, first: {mismatches[0]}"
+
+
+# (user reply, what the scammer said before, expected popup type)
+FEEDBACK_CASES = [
+    ("I'm not giving you my password", "What's your password?", "success"),
+    ("not telling you", "What's your password?", "success"),
+    ("nothing for you", "What's your password?", "success"),
+    ("nah", "What's your email?", "success"),
+    ("never", "What's your birthday?", "success"),
+    ("I won’t tell you", "What's your name?", "success"),
+    ("I'm not sending money", "Can you send me money?", "success"),
+    ("nothing, sorry", "Lend me $20?", "success"),
+    ("I dont have money", "Send me money on venmo", "success"),
+    ("why do you need it?", "What's your address?", "success"),
+    ("sure it's hunter2", "What's your password?", "danger"),
+    ("ok here", "What's your birthday?", "danger"),
+    ("yeah how much", "Can you send me money?", "danger"),
+]
+
+
+def test_feedback_for_refusals_and_compliance():
+    wrong = []
+    for user_message, previous_ai_message, expected in FEEDBACK_CASES:
+        popup = analyze_user_response(user_message, previous_ai_message, stage=3)
+        got = popup.type if popup else None
+        if got != expected:
+            wrong.append((user_message, previous_ai_message, expected, got))
+    assert not wrong, f"wrong feedback: {wrong}"
+
+
+def test_whole_words_only():
+    """Keywords inside other words don't count ("no" in "know", "is" in "this")"""
+    assert analyze_user_response("i know right", "hey cutie", stage=1) is None
+    assert analyze_user_response("this one", "What's your password?", stage=3).type == "warning"
+
+
+if __name__ == "__main__":
+    test_streaming_matches_batch()
+    print("✅ Streaming enhancer matches enhance_response")
+    test_feedback_for_refusals_and_compliance()
+    test_whole_words_only()
+    print("✅ Feedback popups")